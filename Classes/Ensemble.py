@@ -0,0 +1,133 @@
+import os
+import warnings
+from contextlib import ExitStack
+
+import numpy as np
+import netCDF4
+
+import paths
+import Time
+from Land_Mask import to_compact, to_grid, check_grid
+from File_Index import build_file_index, report_duplicates
+
+# Streaming reduction across the TRENDY ensemble on the common standardised grid and 1900-2023 axis.
+# For each block of timesteps the members are visited one at a time: mean/std/min/max are running (Welford)
+# statistics, and the members' blocks are stacked so the quantiles are exact (np.nanquantile over the models).
+# Memory holds time_chunk timesteps of every member, never the whole record.
+
+ENSEMBLE_MODELS = ["CABLE-POP", "CLASSIC", "CLM5.0", "ED", "ELM", "IBIS", "iMAPLE",
+                   "JSBACH", "JULES", "LPJ-GUESS", "LPJml", "LPJwsl", "LPX", "OCN",
+                   "ORCHIDEE", "SDGVM", "VISIT", "VISIT-UT"]
+
+def empty_reduction(shape):
+    return {"count": np.zeros(shape, dtype=np.int64),
+            "mean": np.zeros(shape, dtype=np.float64),
+            "m2": np.zeros(shape, dtype=np.float64),
+            "min": np.full(shape, np.inf),
+            "max": np.full(shape, -np.inf)}
+
+def update_reduction(state, block):
+    # Add one model's block, NaN cells (ocean, missing) are skipped for that model only
+    block = np.asarray(block, dtype=np.float64)
+    valid = ~np.isnan(block)
+    x = np.where(valid, block, 0)
+
+    state["count"] += valid
+    count = state["count"]
+
+    # Welford update
+    delta = np.where(valid, x - state["mean"], 0)
+    state["mean"] += np.divide(delta, count, out=np.zeros_like(delta), where=count > 0)
+    state["m2"] += np.where(valid, delta * (x - state["mean"]), 0)
+
+    np.fmin(state["min"], np.where(valid, x, np.inf), out=state["min"])
+    np.fmax(state["max"], np.where(valid, x, -np.inf), out=state["max"])
+
+def finalize_reduction(state, ddof = 0):
+    # Dict of arrays, NaN where no model had data
+    count = state["count"]
+    has_data = count > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {"count": count,
+                "mean": np.where(has_data, state["mean"], np.nan),
+                "std": np.where(count > ddof, np.sqrt(state["m2"] / (count - ddof)), np.nan),
+                "min": np.where(has_data, state["min"], np.nan),
+                "max": np.where(has_data, state["max"], np.nan)}
+
+def ensemble_quantiles(stack, quantiles = (0.1, 0.5, 0.9)):
+    # stack is (model, ...), exact quantiles (linear interpolation) over the models with data in each cell
+    with warnings.catch_warnings():
+        # Cells where no model has data stay NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        values = np.nanquantile(stack, quantiles, axis=0)
+    return {f"q{int(round(p * 100)):02d}": value for p, value in zip(quantiles, values)}
+
+def ensemble_files(variable, scenario, models = ENSEMBLE_MODELS, root = paths.STD_TIME_OUTPUT):
+    # model -> path of every ensemble member that has the variable for the scenario
+    index, duplicates = build_file_index(root, models=models, scenarios=[scenario], variables=[variable])
+    report_duplicates(duplicates)
+    return {model: index[(model, scenario, variable)] for model in models if (model, scenario, variable) in index}
+
+def reduce_ensemble(files, output_path, quantiles = (0.1, 0.5, 0.9), time_chunk = 12, land = None):
+    # Stream every member in blocks of time_chunk timesteps and write the statistics to output_path.
+    # Members whose shape differs from the first one (e.g. another PFT count or time length) are left out.
+    # With a land mask (Land_Mask.cached_land_mask) only land cells are reduced, ocean is written as NaN.
+    with ExitStack() as stack:
+        # Every member stays pinned in the handle cache until the reduction is written
+        handles = {model: stack.enter_context(Time.cached_dataarray(path)) for model, path in files.items()}
+        first = next(iter(handles.values()))
+        shape, dims = first.shape, first.dims
+        if land is not None and dims[-2:] != ("lat", "lon"):
+            raise ValueError(f"A land mask needs lat and lon as the last dimensions, got {dims}.")
+
+        members = []
+        for model, da in handles.items():
+            if da.shape != shape:
+                print(f"Leaving out {model}, shape {da.shape} does not match {shape}")
+                continue
+            if land is not None:
+                check_grid(land, da["lat"].values, da["lon"].values, files[model])
+            members.append(model)
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        part_path = f"{output_path}.part"
+        stat_names = ["mean", "std", "min", "max"] + [f"q{int(round(p * 100)):02d}" for p in quantiles]
+
+        with netCDF4.Dataset(part_path, "w") as out:
+            # Same dimensions and coordinates as the members
+            for dim, size in zip(dims, shape):
+                out.createDimension(dim, size)
+                if dim in first.coords:
+                    coord = out.createVariable(dim, first[dim].dtype, (dim,))
+                    coord[:] = first[dim].values
+                    coord.setncatts(first[dim].attrs)
+            out.createVariable("n_models", "i2", dims, zlib=True)
+            for stat in stat_names:
+                out.createVariable(stat, "f4", dims, zlib=True, fill_value=np.float32(np.nan))
+            out.setncatts({"variable": first.name, "members": ", ".join(members)})
+
+            time_axis = dims.index("time")
+            for start in range(0, first.sizes["time"], time_chunk):
+                window = slice(start, min(start + time_chunk, first.sizes["time"]))
+                state, stack = None, None
+                for i, model in enumerate(members):
+                    block = handles[model].isel(time=window).values
+                    if land is not None:
+                        block = to_compact(block, land)
+                    if state is None:
+                        state = empty_reduction(block.shape)
+                        stack = np.empty((len(members),) + block.shape, dtype=np.float32)
+                    update_reduction(state, block)
+                    stack[i] = block
+
+                result = finalize_reduction(state)
+                result.update(ensemble_quantiles(stack, quantiles))
+                if land is not None:
+                    result = {name: to_grid(value, land, fill=0 if name == "count" else np.nan) for name, value in result.items()}
+                index = tuple(window if axis == time_axis else slice(None) for axis in range(len(dims)))
+                out.variables["n_models"][index] = result["count"]
+                for stat in stat_names:
+                    out.variables[stat][index] = result[stat].astype(np.float32)
+
+        os.replace(part_path, output_path)
+    return members
@@ -0,0 +1,71 @@
+import os
+from collections import defaultdict
+
+import paths
+
+SCENARIOS = ['S0', 'S1', 'S2', 'S3']
+
+def variable_from_filename(filename):
+    # TRENDY files end in _<variable>.nc, e.g. CABLE-POP_S0_gpp.nc
+    return filename[:-len(".nc")].rsplit("_", 1)[-1]
+
+def keys_from_path(file_path, root):
+    # model, scenario and variable of a file under root/<model>/[<scenario>/...]<name>_<variable>.nc,
+    # scenario is None when no directory below the model is one of SCENARIOS
+    parts = os.path.relpath(file_path, root).split(os.sep)
+    model = parts[0] if len(parts) > 1 else None
+    scenario = next((part for part in parts[1:-1] if part in SCENARIOS), None)
+    return {'model': model, 'scenario': scenario, 'variable': variable_from_filename(parts[-1])}
+
+def build_file_index(root = paths.RAW_OUTPUT, models = None, scenarios = SCENARIOS, variables = None):
+    # Walk root/<model>/<scenario>/ once and map (model, scenario, variable) -> path
+    # Returns the index and a dict of every key that matched more than one file
+    index = {}
+    duplicates = defaultdict(list)
+
+    with os.scandir(root) as model_entries:
+        model_dirs = sorted(e.name for e in model_entries if e.is_dir())
+
+    for model in model_dirs:
+        if models is not None and model not in models:
+            continue
+
+        for scenario in scenarios:
+            scenario_dir = os.path.join(root, model, scenario)
+            if not os.path.isdir(scenario_dir):
+                continue
+
+            with os.scandir(scenario_dir) as file_entries:
+                filenames = sorted(e.name for e in file_entries if e.is_file() and e.name.endswith(".nc"))
+
+            for filename in filenames:
+                var = variable_from_filename(filename)
+                if variables is not None and var not in variables:
+                    continue
+
+                key = (model, scenario, var)
+                path = os.path.join(scenario_dir, filename)
+
+                # Keep the first match in sorted order so the choice is deterministic
+                if key in index:
+                    if not duplicates[key]:
+                        duplicates[key].append(index[key])
+                    duplicates[key].append(path)
+                    continue
+
+                index[key] = path
+
+    return index, dict(duplicates)
+
+def report_duplicates(duplicates, write = print):
+    for (model, scenario, var), matches in sorted(duplicates.items()):
+        write(f"Ambiguous match for {model}/{scenario} and variable {var}, using {os.path.basename(matches[0])}:")
+        for path in matches:
+            write(f"    {path}")
+
+def files_by_model_scenario(index):
+    # Group the index into the {"model/scenario": [filenames]} layout used by the check_timestamps scripts
+    model_scenarios = defaultdict(list)
+    for (model, scenario, _), path in sorted(index.items()):
+        model_scenarios[f"{model}/{scenario}"].append(os.path.basename(path))
+    return dict(model_scenarios)
@@ -0,0 +1,185 @@
+import os
+import hashlib
+import tempfile
+
+import numpy as np
+import netCDF4
+import xarray as xr
+
+import paths
+import Time
+import Pixel_Cache
+from File_Index import build_file_index, report_duplicates
+
+# Land-only storage for the standardised outputs. About 70% of the common grid is ocean, so a (time, lat, lon)
+# cube is mostly NaN. A land mask dict holds the boolean (lat, lon) mask, the flat indices of its land cells and
+# the grid coordinates; to_compact turns any (..., lat, lon) array into (..., n_land) and to_grid scatters it back.
+# The mask is built once from the standardised files and cached as an npz, keyed by a fingerprint of those files.
+
+LAND_MASK_PATH = paths.LAND_MASK # Mask over every standardised file, selections get their own file next to it
+
+def data_variable(nc, path):
+    # The single (time, ..., lat, lon) data variable of an open standardised file, whatever it is named
+    names = [name for name, var in nc.variables.items()
+             if var.ndim > 2 and var.dimensions[0] == "time" and var.dimensions[-2:] == ("lat", "lon")]
+    if len(names) != 1:
+        raise ValueError(f"Expected one (time, ..., lat, lon) variable in {path}, found {names or 'none'}.")
+    return nc.variables[names[0]]
+
+def missing_values(var):
+    # Raw values that mark a gap: _FillValue, missing_value and, without a _FillValue, the netCDF default fill
+    values = [np.asarray(getattr(var, attr)).ravel() for attr in ("_FillValue", "missing_value") if hasattr(var, attr)]
+    if not hasattr(var, "_FillValue") and var.dtype.str[1:] in netCDF4.default_fillvals:
+        values.append(np.array([netCDF4.default_fillvals[var.dtype.str[1:]]]))
+    return np.concatenate(values).astype(np.float64) if values else np.array([])
+
+def land_from_file(path, n_samples = 12):
+    # Cells with data in any of n_samples timesteps spread over the whole record (and any level of extra dimensions
+    # such as PFTs), so variables that only start or stop having data later in the record are still covered.
+    # None for a file without timesteps.
+    with netCDF4.Dataset(path) as nc:
+        var = data_variable(nc, path)
+        if var.shape[0] == 0:
+            return None
+        # Raw packed values, so the comparison with the fill values is not thrown off by scale_factor/add_offset
+        var.set_auto_maskandscale(False)
+        steps = np.unique(np.linspace(0, var.shape[0] - 1, n_samples).astype(int))
+        sampled = np.asarray(var[steps], dtype=np.float64)
+        land = np.isfinite(sampled) & ~np.isin(sampled, missing_values(var))
+        lat, lon = nc.variables["lat"][:], nc.variables["lon"][:]
+    return land.reshape(-1, *land.shape[-2:]).any(axis=0), np.asarray(lat), np.asarray(lon)
+
+def _fingerprint(file_paths, rule):
+    # Changes whenever a source file is added, removed or rewritten
+    digest = hashlib.sha1(rule.encode())
+    for path in sorted(file_paths):
+        st = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}".encode())
+    return digest.hexdigest()
+
+def make_land(mask, lat, lon, fingerprint = ""):
+    mask = np.asarray(mask, dtype=bool)
+    return {"mask": mask, "index": np.flatnonzero(mask), "lat": np.asarray(lat), "lon": np.asarray(lon),
+            "fingerprint": fingerprint}
+
+def build_land_mask(file_paths, rule = "any"):
+    # rule="any" keeps a cell if any file has data there, rule="all" only if every file does.
+    # Files on another grid than the first, or without timesteps, are left out.
+    file_paths = sorted(file_paths)
+    mask, lat, lon = None, None, None
+    for path in file_paths:
+        found = land_from_file(path)
+        if found is None:
+            print(f"Leaving out {path}, it has no timesteps")
+            continue
+        land, file_lat, file_lon = found
+        if mask is None:
+            mask, lat, lon = land, file_lat, file_lon
+        elif land.shape != mask.shape:
+            print(f"Leaving out {path}, grid {land.shape} does not match {mask.shape}")
+        elif rule == "all":
+            mask &= land
+        else:
+            mask |= land
+
+    if mask is None:
+        raise ValueError("No files to build the land mask from.")
+    return make_land(mask, lat, lon, _fingerprint(file_paths, rule))
+
+def save_land_mask(land, path = LAND_MASK_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write then rename so a crash never leaves a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz.tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, mask=land["mask"], lat=land["lat"], lon=land["lon"], fingerprint=land["fingerprint"])
+    os.replace(tmp, path)
+
+def load_land_mask(path = LAND_MASK_PATH):
+    with np.load(path) as data:
+        return make_land(data["mask"], data["lat"], data["lon"], str(data["fingerprint"]))
+
+def mask_path(variables = None, models = None, rule = "any"):
+    # Cache file of a selection, LAND_MASK_PATH for the mask over everything
+    if variables is None and models is None and rule == "any":
+        return LAND_MASK_PATH
+    key = repr((sorted(variables or []), sorted(models or []), rule))
+    return LAND_MASK_PATH.replace(".npz", f"_{hashlib.sha1(key.encode()).hexdigest()[:12]}.npz")
+
+def cached_land_mask(root = paths.STD_TIME_OUTPUT, variables = None, models = None, rule = "any",
+                     path = None, rebuild = False):
+    # Load the cached mask, rebuilding it only when the source files changed (or rebuild=True).
+    # variables/models restrict the mask to the files actually being processed, each selection is cached separately.
+    path = mask_path(variables, models, rule) if path is None else path
+    index, duplicates = build_file_index(root, models=models, variables=variables)
+    report_duplicates(duplicates)
+    file_paths = sorted(index.values())
+
+    if not rebuild and os.path.isfile(path):
+        land = load_land_mask(path)
+        if land["fingerprint"] == _fingerprint(file_paths, rule):
+            return land
+
+    land = build_land_mask(file_paths, rule)
+    save_land_mask(land, path)
+    return land
+
+def n_land(land):
+    return len(land["index"])
+
+def check_grid(land, lat, lon, source = "file"):
+    # to_compact only sees shapes, so a flipped or shifted axis has to be caught from the coordinates
+    lat, lon = np.asarray(lat), np.asarray(lon)
+    if lat.shape != land["lat"].shape or lon.shape != land["lon"].shape or \
+            not (np.allclose(lat, land["lat"]) and np.allclose(lon, land["lon"])):
+        raise ValueError(f"The lat/lon coordinates of {source} do not match the land mask.")
+
+def to_compact(grid, land):
+    # (..., lat, lon) -> (..., n_land), a new contiguous array of the land cells only
+    grid = np.asarray(grid)
+    if grid.shape[-2:] != land["mask"].shape:
+        raise ValueError(f"Grid {grid.shape[-2:]} does not match the land mask {land['mask'].shape}.")
+    return np.take(grid.reshape(grid.shape[:-2] + (-1,)), land["index"], axis=-1)
+
+def to_grid(compact, land, fill = np.nan, out = None):
+    # (..., n_land) -> (..., lat, lon) with fill over the ocean. out (a full-grid array) is reused when given.
+    compact = np.asarray(compact)
+    shape = compact.shape[:-1] + land["mask"].shape
+    if out is None:
+        # A NaN fill needs a float array, integer or boolean values are promoted
+        dtype = np.promote_types(compact.dtype, np.float32) if np.isnan(fill) else compact.dtype
+        out = np.full(shape, fill, dtype=dtype)
+    elif out.shape != shape or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a C-contiguous array of shape {shape}.")
+    flat = out.reshape(compact.shape[:-1] + (-1,))
+    flat[..., land["index"]] = compact
+    return out
+
+def to_grid_dataarray(compact, land, dims = ("time",), coords = None, name = None, attrs = None):
+    # Full-grid DataArray for writing (to_netcdf) and plotting, dims names the leading (non-spatial) dimensions
+    grid = to_grid(compact, land)
+    coords = dict(coords or {})
+    coords.update(lat=land["lat"], lon=land["lon"])
+    return xr.DataArray(grid, dims=tuple(dims) + ("lat", "lon"), coords=coords, name=name, attrs=attrs or {})
+
+def read_compact(path, land, years_after_1900 = None, time_chunk = 120, dtype = np.float32):
+    # Stream a standardised file into (time, ..., n_land) one block of timesteps at a time,
+    # so the full grid is never held for more than time_chunk steps
+    with xr.open_dataarray(path, decode_times=False) as da:
+        if years_after_1900 is not None:
+            da = Time.trim_time_dim(da, years_after_1900)
+        da = da.transpose("time", ..., "lat", "lon")
+        check_grid(land, da["lat"].values, da["lon"].values, path)
+
+        out = np.empty(da.shape[:-2] + (n_land(land),), dtype=dtype)
+        for start in range(0, da.sizes["time"], time_chunk):
+            block = da.isel(time=slice(start, start + time_chunk)).values
+            out[start:start + len(block)] = to_compact(block, land)
+    return out
+
+def cached_read_compact(path, land, years_after_1900 = None):
+    # read_compact served memory-mapped from the pixel cache, a new mask gives a new entry
+    mask_key = hashlib.sha1(np.packbits(land["mask"]).tobytes()).hexdigest()
+    params = {"years_after_1900": years_after_1900, "mask": mask_key}
+    return Pixel_Cache.cached_array(path, "compact", params,
+                                    lambda: read_compact(path, land, years_after_1900=years_after_1900))
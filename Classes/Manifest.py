@@ -0,0 +1,78 @@
+import os
+import json
+import fcntl
+import tempfile
+
+import paths
+
+# Sits next to STD_TIME_OUTPUT and records how every standardised file was produced
+MANIFEST_PATH = f"{paths.STD_TIME}/OUTPUT_manifest.json"
+
+def file_stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def load_manifest(path = MANIFEST_PATH):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(manifest, path = MANIFEST_PATH):
+    # Write then rename so a crash mid-save never leaves a half written manifest
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".json.tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def update_manifest(entries, path = MANIFEST_PATH):
+    # Merge entries into the manifest on disk under a lock, so concurrent runs (e.g. SLURM array tasks) keep each other's records
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            manifest = load_manifest(path)
+            manifest.update(entries)
+            save_manifest(manifest, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def refresh_output_stamp(key, output_path, previous_stamp, path = MANIFEST_PATH):
+    # After an output is rewritten in place by a later stage (e.g. rechunking) that keeps its contents, move the stamp
+    # along so the output is not seen as stale. Only done if the entry matched the file before the rewrite.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            manifest = load_manifest(path)
+            entry = manifest.get(key)
+            if entry is None or entry.get("output_stamp") != previous_stamp:
+                return False
+            entry["output_stamp"] = file_stamp(output_path)
+            save_manifest(manifest, path)
+            return True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def build_record(source_path, **settings):
+    # Everything the output depends on, any change here makes the output stale
+    return dict(settings, source=os.path.abspath(source_path), source_stamp=file_stamp(source_path))
+
+def needs_rebuild(manifest, key, output_path, record):
+    entry = manifest.get(key)
+
+    # Never built, or built by something the manifest does not know about
+    if entry is None or not os.path.isfile(output_path):
+        return True
+
+    # Source file, timestep mapping or tool version changed
+    if any(entry.get(k) != v for k, v in record.items()):
+        return True
+
+    # Output was truncated or touched after it was recorded
+    return entry.get("output_stamp") != file_stamp(output_path)
+
+def record_output(manifest, key, output_path, record):
+    manifest[key] = dict(record, output_stamp=file_stamp(output_path))
+    return manifest[key]
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+import paths
+
+# Queryable SQLite index over the scanned file metadata, one row per NetCDF file.
+# The scanners upsert their records here so questions about the archive become a single indexed query
+# instead of another pandas script over the CSVs.
+
+DB_PATH = paths.METADATA_DB
+
+# name -> SQL type, file_path is the key
+COLUMNS = {
+    'file_path': 'TEXT PRIMARY KEY',
+    'source': 'TEXT',           # 'inputs' or 'outputs'
+    'model': 'TEXT',
+    'scenario': 'TEXT',
+    'variable': 'TEXT',
+    'has_time': 'INTEGER',
+    'calendar': 'TEXT',
+    'units': 'TEXT',
+    'dtype': 'TEXT',
+    'n_timesteps': 'INTEGER',
+    'start_date': 'TEXT',       # YYYY-MM-DD of the first timestep
+    'start_year': 'INTEGER',
+    'step_days': 'REAL',        # Spacing of the first two timesteps
+    'frequency': 'TEXT',        # daily, monthly, annual or other
+    'can_decode_times': 'INTEGER',
+    'error': 'TEXT'
+}
+
+INDEXED = ['model', 'scenario', 'variable', 'calendar', 'units', 'n_timesteps', 'start_year', 'frequency']
+
+# The combination unique_combinations_inputs.py looks for
+COMBO_COLUMNS = ['has_time', 'calendar', 'units', 'dtype']
+
+def connect(db_path = DB_PATH):
+    # Creates the table and indexes the first time
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=60)
+    columns = ", ".join(f"{name} {sql_type}" for name, sql_type in COLUMNS.items())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS files ({columns})")
+    for name in INDEXED:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_files_{name} ON files ({name})")
+    return conn
+
+def frequency_from_step(step_days):
+    if step_days is None:
+        return None
+    if 0.9 <= step_days <= 1.1:
+        return 'daily'
+    if 27 <= step_days <= 32:
+        return 'monthly'
+    if 359 <= step_days <= 367:
+        return 'annual'
+    return 'other'
+
+def _clean(value):
+    # NaN from pandas frames and numpy scalars from the probes
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+def _row(record, source):
+    row = {name: _clean(record.get(name)) for name in COLUMNS}
+    row['source'] = source
+    if row['start_date'] is not None and row['start_year'] is None:
+        row['start_year'] = int(str(row['start_date']).split('-')[0])
+    if row['frequency'] is None:
+        row['frequency'] = frequency_from_step(row['step_days'])
+    # Scanners report counts as 'unavailable' for scalar time variables. Counts from pandas frames come back as
+    # floats (1488.0) once any file in the column lacks one, so integral floats are kept as ints.
+    count = row['n_timesteps']
+    if isinstance(count, float) and count.is_integer():
+        row['n_timesteps'] = int(count)
+    elif not isinstance(count, (int, type(None))) or isinstance(count, bool):
+        row['n_timesteps'] = None
+    return row
+
+def upsert_records(records, source, db_path = DB_PATH):
+    # records are dicts keyed by the COLUMNS names, missing keys are stored as NULL
+    rows = [_row(record, source) for record in records]
+    names = list(COLUMNS)
+    sql = f"INSERT OR REPLACE INTO files ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+    with closing(connect(db_path)) as conn, conn:
+        conn.executemany(sql, [tuple(row[name] for name in names) for row in rows])
+    return len(rows)
+
+def remove_files(file_paths, db_path = DB_PATH):
+    # Files that have been deleted since the last scan
+    with closing(connect(db_path)) as conn, conn:
+        conn.executemany("DELETE FROM files WHERE file_path = ?", [(p,) for p in file_paths])
+
+def _where(filters):
+    # column=value, a list/tuple for IN, None for IS NULL
+    clauses, params = [], []
+    for name, value in filters.items():
+        if name not in COLUMNS:
+            raise ValueError(f"Unknown column: {name}")
+        if value is None:
+            clauses.append(f"{name} IS NULL")
+        elif isinstance(value, (list, tuple, set)):
+            value = list(value)
+            clauses.append(f"{name} IN ({', '.join('?' for _ in value)})")
+            params.extend(value)
+        else:
+            clauses.append(f"{name} = ?")
+            params.append(value)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+def _check_columns(columns):
+    for name in columns:
+        if name not in COLUMNS:
+            raise ValueError(f"Unknown column: {name}")
+
+def query_files(columns = None, limit = None, db_path = DB_PATH, **filters):
+    # e.g. query_files(calendar='365_day', frequency='monthly', start_year=1701)
+    columns = columns or list(COLUMNS)
+    _check_columns(columns)
+    where, params = _where(filters)
+    sql = f"SELECT {', '.join(columns)} FROM files{where} ORDER BY file_path"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    with closing(connect(db_path)) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+def example_per_combo(columns = COMBO_COLUMNS, db_path = DB_PATH, **filters):
+    # One example file and a file count for every distinct combination of columns
+    columns = list(columns)
+    _check_columns(columns)
+    where, params = _where(filters)
+    group = ", ".join(columns)
+    sql = (f"SELECT {group}, COUNT(*) AS n_files, MIN(file_path) AS example_file "
+           f"FROM files{where} GROUP BY {group} ORDER BY {group}")
+    with closing(connect(db_path)) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
@@ -0,0 +1,86 @@
+import os
+import fcntl
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Long-format store of the time metadata: one row per (model, scenario, variable) file with a column per field.
+# The wide variable x model/scenario CSVs and the plots are views derived from this table.
+
+ID_COLUMNS = ['model', 'scenario', 'variable', 'file_path']
+
+# Values of the Exists field, shared by every writer so filters on it mean the same for all of them
+TIME_PRESENT = 'Present'
+TIME_MISSING = 'Missing'
+
+def records_to_frame(entries, records):
+    # entries are (model, scenario, variable, file_path) tuples in the same order as the probe records
+    ids = pd.DataFrame(list(entries), columns=ID_COLUMNS)
+    fields = pd.DataFrame.from_records(list(records), index=ids.index)
+    return pd.concat([ids, fields], axis=1)
+
+def write_store(df, path):
+    # Parquet keeps the column types, so Num_Timesteps stays numeric and error strings stay strings
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Columns mixing numbers and messages (e.g. Num_Timesteps 'unavailable') are stored as text
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].map(lambda v: v if v is None or (isinstance(v, float) and pd.isna(v)) else str(v))
+
+    tmp = f"{path}.tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+def read_store(path):
+    return pd.read_parquet(path)
+
+@contextmanager
+def store_lock(path):
+    # Exclusive lock of the store, hold it across everything derived from the store (wide CSVs, SQLite index)
+    # so concurrent writers (e.g. SLURM array tasks of the conversion) are serialised
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def merge_store(df, path, removed = ()):
+    # Merge rows into the store on disk by file_path, call it under store_lock.
+    # A row replaces the earlier row of its file, but fields it does not have (e.g. the conversion's Validation
+    # when a checker writes) are kept from the earlier row. removed are file paths to drop from the store.
+    if os.path.isfile(path):
+        existing = read_store(path)
+        existing = existing[~existing['file_path'].isin(removed)]
+        replaced = existing['file_path'].isin(df['file_path'])
+        kept = [col for col in existing.columns if col not in df.columns]
+        if kept:
+            df = df.join(existing.loc[replaced].set_index('file_path')[kept], on='file_path')
+        df = pd.concat([existing[~replaced], df], ignore_index=True)
+    write_store(df, path)
+    return df
+
+def update_store(df, path, removed = ()):
+    with store_lock(path):
+        return merge_store(df, path, removed)
+
+def wide_view(df, field, variables = None):
+    # The original variable x "model/scenario" layout of the per-key CSVs
+    df = df.assign(column=df['model'] + '/' + df['scenario'])
+    columns, index = sorted(df['column'].unique()), sorted(df['variable'].unique())
+    # Writers may record the same file under different paths, the latest row that has the field wins
+    rows = df.dropna(subset=[field]).drop_duplicates(subset=['variable', 'column'], keep='last')
+    wide = rows.pivot(index='variable', columns='column', values=field).reindex(index=index, columns=columns)
+    wide.index.name = None
+    wide.columns.name = None
+    if variables is not None:
+        wide = wide.reindex(variables)
+    # Missing cells would otherwise turn integer counts into floats
+    return wide.convert_dtypes()
+
+def write_wide_csvs(df, fields, output_dir, variables = None):
+    for field in fields:
+        if field in df.columns:
+            wide_view(df, field, variables).to_csv(os.path.join(output_dir, f"{field}.csv"))
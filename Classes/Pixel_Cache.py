@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+import paths
+import Time
+
+# On-disk cache of extracted and trimmed series, served memory-mapped so repeated runs skip the NetCDF decode
+CACHE_DIR = paths.PIXEL_CACHE
+MAX_CACHE_BYTES = 20 * 1024**3 # Oldest entries are evicted once the cache grows past this
+
+def _source_stamp(path):
+    # Anything that changes these invalidates the cached entry
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+def _entry_paths(path, kind, params):
+    # One entry per source file and extraction, the stamp is checked separately so stale entries get replaced
+    key = json.dumps({"path": os.path.abspath(path), "kind": kind, "params": params}, sort_keys=True)
+    stem = os.path.join(CACHE_DIR, hashlib.sha1(key.encode()).hexdigest())
+    return f"{stem}.npy", f"{stem}.json"
+
+def _atomic_save(array, npy_path, meta, meta_path):
+    # Write to a temp file in the cache directory then rename so readers never see a partial entry
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".npy.tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, npy_path)
+
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".json.tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+def _remove_entry(npy_path, meta_path):
+    for p in (npy_path, meta_path):
+        if os.path.exists(p):
+            os.remove(p)
+
+def cache_size():
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    return sum(os.path.getsize(os.path.join(CACHE_DIR, f)) for f in os.listdir(CACHE_DIR) if f.endswith(".npy"))
+
+def enforce_size_cap(max_bytes=None):
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    entries = []
+    for f in os.listdir(CACHE_DIR):
+        if f.endswith(".npy"):
+            p = os.path.join(CACHE_DIR, f)
+            st = os.stat(p)
+            entries.append((st.st_mtime, st.st_size, p))
+
+    # Evict oldest-first until the cache fits
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove_entry(p, p[:-len(".npy")] + ".json")
+        total -= size
+
+def clear_cache():
+    if os.path.isdir(CACHE_DIR):
+        for f in os.listdir(CACHE_DIR):
+            if f.endswith((".npy", ".json")):
+                os.remove(os.path.join(CACHE_DIR, f))
+
+def cached_array(path, kind, params, compute):
+    # Return compute() for this source file, loading it memory-mapped from the cache when still valid
+    npy_path, meta_path = _entry_paths(path, kind, params)
+    stamp = _source_stamp(path)
+
+    if os.path.isfile(npy_path) and os.path.isfile(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("source") == stamp:
+            return np.load(npy_path, mmap_mode="r")
+        # Source changed since this entry was written
+        _remove_entry(npy_path, meta_path)
+
+    array = np.asarray(compute())
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _atomic_save(array, npy_path, {"source": stamp, "kind": kind, "params": params}, meta_path)
+    cached = np.load(npy_path, mmap_mode="r")
+    enforce_size_cap()
+
+    return cached
+
+def cached_extract_and_trim(path, years_after_1900, lat = 51, lon = 11):
+    params = {"years_after_1900": years_after_1900, "lat": lat, "lon": lon}
+    return cached_array(path, "extract_and_trim", params,
+                        lambda: Time.extract_np_array(path, lat, lon, years_after_1900=years_after_1900))
+
+def cached_extract_trim_and_datetime(path, years_after_1900, lat = 51, lon = 11):
+    trimmed_arr = cached_extract_and_trim(path, years_after_1900, lat, lon)
+    dt = Time.generate_dt(trimmed_arr, years_after_1900)
+    return(trimmed_arr, dt)
+
+def cached_extract_and_trim_points(path, lats, lons, years_after_1900):
+    params = {"years_after_1900": years_after_1900,
+              "lats": np.atleast_1d(lats).tolist(), "lons": np.atleast_1d(lons).tolist()}
+    return cached_array(path, "extract_and_trim_points", params,
+                        lambda: Time.extract_and_trim_points(path, lats, lons, years_after_1900))
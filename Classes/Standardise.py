@@ -1,8 +1,234 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+import Time
+from Land_Mask import to_compact, check_grid
+
 def standardize_series(series):
     mean = np.mean(series)
     std = np.std(series)
-    
+
     if std == 0:
         raise ValueError("Standard deviation is zero; cannot standardize.")
-    
-    return (series - mean) / std
\ No newline at end of file
+
+    return (series - mean) / std
+
+# Streaming statistics for data that does not fit in memory. A state is a dict of count, mean and m2
+# (sum of squared deviations) arrays, either scalars (per variable) or one value per pixel. Chunks are
+# reduced on their own and merged with Chan's parallel update, so partial states from different files
+# or worker processes combine exactly. NaNs (ocean, missing data) are skipped.
+
+def empty_stats(shape = ()):
+    return {"count": np.zeros(shape, dtype=np.int64),
+            "mean": np.zeros(shape, dtype=np.float64),
+            "m2": np.zeros(shape, dtype=np.float64)}
+
+def chunk_stats(chunk, axis = None):
+    # axis=None reduces everything to one value, axis=0 on a (time, lat, lon) chunk keeps one value per pixel
+    chunk = np.asarray(chunk, dtype=np.float64)
+    valid = ~np.isnan(chunk)
+    count = valid.sum(axis=axis)
+
+    total = np.where(valid, chunk, 0).sum(axis=axis)
+    mean = np.divide(total, count, out=np.zeros(np.shape(total)), where=count > 0)
+
+    deviation = np.where(valid, chunk - (mean if axis is None else np.expand_dims(mean, axis)), 0)
+    m2 = (deviation ** 2).sum(axis=axis)
+    return {"count": np.asarray(count, dtype=np.int64), "mean": np.asarray(mean), "m2": np.asarray(m2)}
+
+def _land_fields(a, b):
+    # Per-pixel states built on a land mask carry it, only states on the same cells can be merged
+    if "land_mask" not in a and "land_mask" not in b:
+        return {}
+    if "land_mask" not in a or "land_mask" not in b or not np.array_equal(a["land_mask"], b["land_mask"]):
+        raise ValueError("Cannot merge statistics computed on different land masks.")
+    return {"land_mask": a["land_mask"], "land_fingerprint": a["land_fingerprint"]}
+
+def merge_stats(a, b):
+    # Chan et al. pairwise update, exact for any split of the data
+    land = _land_fields(a, b)
+    count = a["count"] + b["count"]
+    safe_count = np.where(count > 0, count, 1)
+    delta = b["mean"] - a["mean"]
+
+    mean = a["mean"] + delta * b["count"] / safe_count
+    m2 = a["m2"] + b["m2"] + delta ** 2 * a["count"] * b["count"] / safe_count
+    return dict({"count": count, "mean": np.where(count > 0, mean, 0), "m2": np.where(count > 0, m2, 0)}, **land)
+
+def update_stats(state, chunk, axis = None):
+    return merge_stats(state, chunk_stats(chunk, axis))
+
+def finalize_stats(state, ddof = 0):
+    # ddof=0 matches np.std in standardize_series. Pixels that never had data come back as NaN.
+    count = state["count"]
+    mean = np.where(count > 0, state["mean"], np.nan)
+    variance = np.where(count > ddof, state["m2"] / np.where(count > ddof, count - ddof, 1), np.nan)
+    return mean, np.sqrt(variance)
+
+def file_stats(path, per_pixel = False, years_after_1900 = None, time_chunk = 120, land = None):
+    # One pass over a file in blocks of time_chunk timesteps, only one block is ever in memory.
+    # With a land mask (Land_Mask.cached_land_mask) only land cells are read into the statistics,
+    # per-pixel states are then (..., n_land), carry the mask they were built on, and Land_Mask.to_grid
+    # puts them back on the grid.
+    with xr.open_dataarray(path, decode_times=False) as da:
+        if years_after_1900 is not None:
+            da = Time.trim_time_dim(da, years_after_1900)
+        if land is not None:
+            if da.dims[-2:] != ("lat", "lon"):
+                raise ValueError(f"A land mask needs lat and lon as the last dimensions, got {da.dims}.")
+            check_grid(land, da["lat"].values, da["lon"].values, path)
+
+        axis = da.get_axis_num("time") if per_pixel else None
+        state = None
+        for start in range(0, da.sizes["time"], time_chunk):
+            block = da.isel(time=slice(start, start + time_chunk)).values
+            if land is not None:
+                block = to_compact(block, land)
+            partial = chunk_stats(block, axis)
+            state = partial if state is None else merge_stats(state, partial)
+
+    if state is not None and land is not None and per_pixel:
+        state.update(land_mask=land["mask"], land_fingerprint=np.array(land["fingerprint"]))
+    return state # None when no timesteps are left after trimming
+
+def stats_over_files(file_paths, per_pixel = False, years_after_1900 = None, time_chunk = 120, workers = 1, land = None):
+    # Files are reduced independently (in parallel if workers > 1) and their states merged.
+    # Per-pixel statistics need every file on the same grid.
+    file_paths = list(file_paths)
+    args = [(p, per_pixel, years_after_1900, time_chunk, land) for p in file_paths]
+
+    if workers <= 1:
+        states = [file_stats(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            states = list(pool.map(file_stats, *zip(*args)))
+
+    # Files with no timesteps left after trimming come back as None and add nothing
+    state = None
+    for partial in states:
+        if partial is None:
+            continue
+        state = partial if state is None else merge_stats(state, partial)
+    return state
+
+def save_stats(stats, path):
+    # stats is {variable: state}, written as one npz with "<variable>/<field>" arrays
+    arrays = {f"{var}/{field}": value for var, state in stats.items() for field, value in state.items()}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write then rename so a crash never leaves a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz.tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+def load_stats(path, land = None):
+    # land checks that per-pixel states line up with the cells of the current land mask
+    stats = {}
+    with np.load(path) as data:
+        for key in data.files:
+            var, field = key.rsplit("/", 1)
+            stats.setdefault(var, {})[field] = data[key]
+
+    if land is not None:
+        for var, state in stats.items():
+            if "land_mask" not in state or not np.array_equal(state["land_mask"], land["mask"]):
+                raise ValueError(f"Statistics of {var} in {path} were not computed on this land mask "
+                                 f"(saved {state.get('land_fingerprint', 'none')}, current {land['fingerprint']}).")
+    return stats
+
+def _safe_std(std):
+    # Constant pixels (e.g. fLuc in S0) are centred but not scaled
+    if np.ndim(std) == 0:
+        if std == 0:
+            raise ValueError("Standard deviation is zero; cannot standardize.")
+        return std
+    return np.where(std == 0, 1, std)
+
+def standardize_chunk(chunk, mean, std):
+    # mean/std from finalize_stats, per-pixel ones broadcast over the leading time axis
+    return (chunk - mean) / _safe_std(std)
+
+def inverse_standardize_chunk(chunk, mean, std):
+    return chunk * _safe_std(std) + mean
+
+# Climatological standardisation of (time, lat, lon) cubes: every pixel has its calendar-month mean removed and
+# is divided by its calendar-month std. Everything runs in float32 on views of the cube, one calendar month at a
+# time, so the only temporaries are the size of one month's slice. NaN (ocean) cells stay NaN.
+# Compact (time, n_land) cubes from Land_Mask work the same way and skip the ocean altogether.
+
+def calendar_months(dt):
+    # Calendar month (1-12) of each timestep, from the datetime64 array of Time.generate_dt
+    return np.asarray(dt).astype("datetime64[M]").astype(np.int64) % 12 + 1
+
+def _month_indexers(months):
+    # One indexer per calendar month, a strided slice (a view) when the months simply cycle
+    months = np.asarray(months)
+    n = len(months)
+    if n and np.array_equal(months, (np.arange(n) + months[0] - 1) % 12 + 1):
+        return {(months[0] - 1 + k) % 12 + 1: slice(k, None, 12) for k in range(min(12, n))}
+    return {m: np.flatnonzero(months == m) for m in np.unique(months)}
+
+def monthly_climatology(cube, months):
+    # mean and std of shape (12, ...) in float32, NaN for months or pixels without data
+    mean = np.full((12,) + cube.shape[1:], np.nan, dtype=np.float32)
+    std = np.full((12,) + cube.shape[1:], np.nan, dtype=np.float32)
+
+    for month, indexer in _month_indexers(months).items():
+        block = cube[indexer]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            valid = ~np.isnan(block)
+            count = valid.sum(axis=0)
+            month_mean = np.where(valid, block, 0).sum(axis=0, dtype=np.float64) / count
+            deviation = np.where(valid, block - month_mean.astype(np.float32), 0)
+            month_var = (deviation * deviation).sum(axis=0, dtype=np.float64) / count
+        mean[month - 1] = month_mean
+        std[month - 1] = np.sqrt(month_var)
+
+    return mean, std
+
+def standardize_cube_monthly(cube, months, stats = None, in_place = False):
+    # cube (time, ...) and months (1-12 per timestep, see calendar_months).
+    # stats=(mean, std) applies existing stats (e.g. from the training period), otherwise they are computed.
+    # in_place=True reuses a float32 cube as the output, anything else is converted to a new float32 array.
+    # Returns the standardised cube and the (mean, std) needed by inverse_standardize_cube_monthly.
+    if in_place and cube.dtype == np.float32:
+        out = cube
+    else:
+        out = np.array(cube, dtype=np.float32)
+
+    mean, std = stats if stats is not None else monthly_climatology(out, months)
+    safe_std = np.where(std == 0, np.float32(1), std)
+
+    for month, indexer in _month_indexers(months).items():
+        if isinstance(indexer, slice):
+            view = out[indexer]
+            view -= mean[month - 1]
+            view /= safe_std[month - 1]
+        else:
+            out[indexer] = (out[indexer] - mean[month - 1]) / safe_std[month - 1]
+
+    return out, (mean, std)
+
+def inverse_standardize_cube_monthly(cube, months, stats, in_place = False):
+    if in_place and cube.dtype == np.float32:
+        out = cube
+    else:
+        out = np.array(cube, dtype=np.float32)
+
+    mean, std = stats
+    safe_std = np.where(std == 0, np.float32(1), std)
+
+    for month, indexer in _month_indexers(months).items():
+        if isinstance(indexer, slice):
+            view = out[indexer]
+            view *= safe_std[month - 1]
+            view += mean[month - 1]
+        else:
+            out[indexer] = out[indexer] * safe_std[month - 1] + mean[month - 1]
+
+    return out
@@ -1,16 +1,137 @@
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from contextlib import contextmanager
+
 import xarray as xr
 import numpy as np
 
-def extract_np_array(path, lat = 51, lon = 11):
-    ds = xr.open_dataarray(path, decode_times=False)
+# Process-wide LRU cache of open files, keyed by (path, mtime) so a rewritten file is reopened.
+# Readers pin a handle with cached_dataarray while they use it; an evicted handle that is still pinned
+# (e.g. by another thread) is only closed once its last reader releases it.
+MAX_OPEN_FILES = 32 # Set to 0 to open and close the file on every call
+_handle_cache = OrderedDict()
+_handle_users = {} # id(ds) -> number of readers holding it
+_retired_handles = {} # id(ds) -> ds, evicted while in use
+_handle_lock = threading.Lock()
+_handle_stats = {"hits": 0, "misses": 0, "evictions": 0}
 
-    ds_arr = np.array(ds.sel(lat=lat, lon=lon, method="nearest"))
-    
-    ds.close()
+def set_max_open_files(max_open_files):
+    global MAX_OPEN_FILES
+    with _handle_lock:
+        MAX_OPEN_FILES = max_open_files
+        _evict_handles()
+
+def _retire_handle(ds):
+    # Close now if idle, otherwise leave it to the last reader, caller holds the lock
+    if _handle_users.get(id(ds), 0) > 0:
+        _retired_handles[id(ds)] = ds
+    else:
+        ds.close()
+
+def _evict_handles():
+    # Drop the least recently used handles until the cache fits, caller holds the lock
+    while len(_handle_cache) > max(MAX_OPEN_FILES, 0):
+        _, ds = _handle_cache.popitem(last=False)
+        _retire_handle(ds)
+        _handle_stats["evictions"] += 1
+
+def _acquire_handle(path, pin):
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path))
+
+    with _handle_lock:
+        if key in _handle_cache:
+            _handle_cache.move_to_end(key)
+            _handle_stats["hits"] += 1
+            ds = _handle_cache[key]
+        else:
+            _handle_stats["misses"] += 1
+
+            # Drop handles to older versions of the same file
+            for stale in [k for k in _handle_cache if k[0] == path]:
+                _retire_handle(_handle_cache.pop(stale))
+
+            ds = xr.open_dataarray(path, decode_times=False)
+            _handle_cache[key] = ds
+
+        # Pin before evicting so a cache smaller than the number of readers never closes this one
+        if pin:
+            _handle_users[id(ds)] = _handle_users.get(id(ds), 0) + 1
+        _evict_handles()
+        return ds
+
+def _release_handle(ds):
+    with _handle_lock:
+        _handle_users[id(ds)] -= 1
+        if _handle_users[id(ds)] == 0:
+            del _handle_users[id(ds)]
+            if id(ds) in _retired_handles:
+                _retired_handles.pop(id(ds)).close()
+
+def open_cached_dataarray(path):
+    # Unpinned handle, fine for a quick read but a later open may evict and close it.
+    # Use cached_dataarray when the handle is kept while other files are opened or other threads read.
+    return _acquire_handle(path, pin=False)
+
+@contextmanager
+def cached_dataarray(path):
+    ds = _acquire_handle(path, pin=True)
+    try:
+        yield ds
+    finally:
+        _release_handle(ds)
+
+def handle_cache_info():
+    with _handle_lock:
+        return dict(_handle_stats, open_files=len(_handle_cache), in_use=len(_handle_users),
+                    retired=len(_retired_handles), max_open_files=MAX_OPEN_FILES)
+
+def clear_handle_cache():
+    with _handle_lock:
+        while _handle_cache:
+            _retire_handle(_handle_cache.popitem()[1])
+        _handle_stats.update(hits=0, misses=0, evictions=0)
+
+@contextmanager
+def _open_dataarray(path):
+    # Serve a pinned handle from the cache, or fall back to open-and-close when caching is disabled
+    if MAX_OPEN_FILES > 0:
+        with cached_dataarray(path) as ds:
+            yield ds
+    else:
+        ds = xr.open_dataarray(path, decode_times=False)
+        try:
+            yield ds
+        finally:
+            ds.close()
+
+def extract_np_array(path, lat = 51, lon = 11, years_after_1900 = None):
+    with _open_dataarray(path) as ds:
+        # Push the 1900 trim into the read so earlier timesteps are never loaded
+        selected = ds if years_after_1900 is None else trim_time_dim(ds, years_after_1900)
+
+        ds_arr = np.array(selected.sel(lat=lat, lon=lon, method="nearest"))
     
     return(ds_arr)
+
+def extract_np_array_points(path, lats, lons, years_after_1900 = None):
+    # Open the file once and pull the nearest pixel for every (lat, lon) pair
+    with _open_dataarray(path) as ds:
+        selected = ds if years_after_1900 is None else trim_time_dim(ds, years_after_1900)
+
+        # Pointwise (vectorized) nearest-neighbour selection along a shared "points" dimension
+        lats = xr.DataArray(np.atleast_1d(lats), dims="points")
+        lons = xr.DataArray(np.atleast_1d(lons), dims="points")
+        points = selected.sel(lat=lats, lon=lons, method="nearest")
+
+        # Shape (n_points, time, ...)
+        ds_arr = np.array(points.transpose("points", "time", ...))
+
+    return(ds_arr)
     
-def trim_outputs_array(np_array, years_after_1900):
+def get_trim_index(length, years_after_1900):
     years = years_after_1900
     months = years * 12
     # Format - start date, interval, trim index
@@ -26,47 +147,90 @@ def trim_outputs_array(np_array, years_after_1900):
                 10 : ("1700-01-01", "once", 9) # For all data with 10 timesteps they are all 0 and can be reduced to a single timestep
             }
     
-    length = len(np_array)
+    # The point at which to trim the array so that it starts at 1900-01-01
+    return timestep_map[length][2]
+
+def trim_time_dim(ds, years_after_1900):
+    # Resolve the trim index from the time dimension length alone, before any data is read
+    trim_index = get_trim_index(ds.sizes["time"], years_after_1900)
+    return ds.isel(time=slice(trim_index, None))
     
-     # Save the start_date, interval and the point at which to trim the array so that it starts at 1900-01-01
-    trim_index = timestep_map[length][2]
+def trim_outputs_array(np_array, years_after_1900, axis=0):
+    trim_index = get_trim_index(np_array.shape[axis], years_after_1900)
     
-    # Trim the array
-    np_trimmed = np_array[trim_index:]
+    # Trim the array along the time axis
+    index = [slice(None)] * np_array.ndim
+    index[axis] = slice(trim_index, None)
+    np_trimmed = np_array[tuple(index)]
     
     return(np_trimmed)
     
     
-def generate_dt(trimmed_array, years_after_1900):
-    # Trim the array
-    length = len(trimmed_array)
-    
+def generate_dt(trimmed_array, years_after_1900, axis=0):
+    # The dates are built once per trimmed length, callers get their own writable copy (a plain memcpy)
+    return _interned_dt(trimmed_array.shape[axis], years_after_1900).copy()
+
+@lru_cache(maxsize=None)
+def _interned_dt(length, years_after_1900):
     years = years_after_1900
     months = years * 12
     
     if length == 1488 - months:
         start = np.datetime64("1900-01", "M") + months  # use month precision
         dates = start + np.arange(length).astype("timedelta64[M]")
-        return dates.astype("datetime64[D]")  # optional: convert to full date
+        dates = dates.astype("datetime64[D]")  # optional: convert to full date
 
     elif length == 124 - years:
         start = np.datetime64("1900", "Y") + years  # use year precision
         dates = start + np.arange(length).astype("timedelta64[Y]")
-        return dates.astype("datetime64[D]")  # optional: convert to full date
+        dates = dates.astype("datetime64[D]")  # optional: convert to full date
 
     elif length == 1:
-        return np.array([np.datetime64("1900", "Y") + years], dtype="datetime64[D]")
+        dates = np.array([np.datetime64("1900", "Y") + years], dtype="datetime64[D]")
 
     else:
         raise ValueError(f"Unexpected number of timesteps: {length}")
 
+    dates.flags.writeable = False
+    return dates
+
 def extract_and_trim(path, years_after_1900):
-    np_arr = extract_np_array(path)
-    trimmed_arr = trim_outputs_array(np_arr, years_after_1900)
+    trimmed_arr = extract_np_array(path, years_after_1900=years_after_1900)
     return trimmed_arr
         
 def extract_trim_and_datetime(path, years_after_1900):
-    np_arr=extract_np_array(path)
-    trimmed_arr = trim_outputs_array(np_arr, years_after_1900)
+    trimmed_arr = extract_np_array(path, years_after_1900=years_after_1900)
     dt = generate_dt(trimmed_arr, years_after_1900)
     return(trimmed_arr,dt)
+
+def iter_trimmed_tiles(path, years_after_1900, tile_lat = 60, tile_lon = 120, skip_empty = True):
+    # Walk the full grid in lat/lon tiles so memory depends on the tile size rather than the whole cube
+    with _open_dataarray(path) as ds:
+        trimmed = trim_time_dim(ds, years_after_1900)
+
+        # Every tile shares the same trimmed time axis
+        dt = generate_dt(trimmed, years_after_1900, axis=trimmed.get_axis_num("time"))
+
+        n_lat, n_lon = trimmed.sizes["lat"], trimmed.sizes["lon"]
+        for lat_start in range(0, n_lat, tile_lat):
+            for lon_start in range(0, n_lon, tile_lon):
+                tile_slice = (slice(lat_start, min(lat_start + tile_lat, n_lat)),
+                              slice(lon_start, min(lon_start + tile_lon, n_lon)))
+
+                data = np.array(trimmed.isel(lat=tile_slice[0], lon=tile_slice[1]))
+
+                # Ocean-only tiles carry nothing to train on
+                if skip_empty and np.isnan(data).all():
+                    continue
+
+                yield tile_slice, data, dt
+
+def extract_and_trim_points(path, lats, lons, years_after_1900):
+    trimmed_arr = extract_np_array_points(path, lats, lons, years_after_1900=years_after_1900)
+    return trimmed_arr
+
+def extract_trim_and_datetime_points(path, lats, lons, years_after_1900):
+    # All points share the file's time axis, so one date array covers the whole block
+    trimmed_arr = extract_np_array_points(path, lats, lons, years_after_1900=years_after_1900)
+    dt = generate_dt(trimmed_arr, years_after_1900, axis=1)
+    return(trimmed_arr, dt)
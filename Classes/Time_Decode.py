@@ -0,0 +1,312 @@
+import os
+import re
+import json
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+
+# Vectorised decoder for raw NetCDF time axes. Every timestep of the axis is converted in one pass of
+# integer NumPy arithmetic, for every unit family the TRENDY files use:
+#   <seconds|minutes|hours|days> since <date>, months since <date>, years since <date>, day as %Y%m%d.%f
+# and every CF calendar. Dates are held as day ordinals within the file's own calendar, so 360_day and
+# 365_day axes never go through a real-world calendar (and never hit Feb 29/30 problems).
+
+DAY_FACTORS = {'second': 1 / 86400, 'minute': 1 / 1440, 'hour': 1 / 24, 'day': 1}
+
+CALENDAR_ALIASES = {
+    'standard': 'standard', 'gregorian': 'standard', 'none': 'standard', '': 'standard',
+    'proleptic_gregorian': 'proleptic_gregorian',
+    'julian': 'julian',
+    '365_day': '365_day', 'noleap': '365_day',
+    '366_day': '366_day', 'all_leap': '366_day',
+    '360_day': '360_day'
+}
+
+# Julian day number of 1970-01-01, the datetime64 epoch
+EPOCH_JDN = 2440588
+
+# Julian day number of 1582-10-15, where the standard calendar switches from Julian to Gregorian
+GREGORIAN_START_JDN = 2299161
+
+MONTH_DAYS_365 = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+MONTH_DAYS_366 = np.array([31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+CUM_DAYS_365 = np.concatenate([[0], np.cumsum(MONTH_DAYS_365)])
+CUM_DAYS_366 = np.concatenate([[0], np.cumsum(MONTH_DAYS_366)])
+
+def normalise_calendar(calendar):
+    name = str(calendar).strip().lower() if calendar is not None else 'standard'
+    if name not in CALENDAR_ALIASES:
+        raise ValueError(f"Unsupported calendar: {calendar}")
+    return CALENDAR_ALIASES[name]
+
+# Julian day numbers, valid for any integer year (Fliegel & Van Flandern)
+def _gregorian_jdn(y, m, d):
+    a = (14 - m) // 12
+    y2 = y + 4800 - a
+    m2 = m + 12 * a - 3
+    return d + (153 * m2 + 2) // 5 + 365 * y2 + y2 // 4 - y2 // 100 + y2 // 400 - 32045
+
+def _julian_jdn(y, m, d):
+    a = (14 - m) // 12
+    y2 = y + 4800 - a
+    m2 = m + 12 * a - 3
+    return d + (153 * m2 + 2) // 5 + 365 * y2 + y2 // 4 - 32083
+
+def _gregorian_from_jdn(jdn):
+    a = jdn + 32044
+    b = (4 * a + 3) // 146097
+    c = a - 146097 * b // 4
+    d = (4 * c + 3) // 1461
+    e = c - 1461 * d // 4
+    m = (5 * e + 2) // 153
+    return 100 * b + d - 4800 + m // 10, m + 3 - 12 * (m // 10), e - (153 * m + 2) // 5 + 1
+
+def _julian_from_jdn(jdn):
+    c = jdn + 32082
+    d = (4 * c + 3) // 1461
+    e = c - 1461 * d // 4
+    m = (5 * e + 2) // 153
+    return d - 4800 + m // 10, m + 3 - 12 * (m // 10), e - (153 * m + 2) // 5 + 1
+
+def ymd_to_ordinal(y, m, d, calendar):
+    # Integer day number of each (year, month, day) within the calendar, consecutive days differ by 1
+    y, m, d = (np.asarray(v, dtype=np.int64) for v in (y, m, d))
+    calendar = normalise_calendar(calendar)
+
+    if calendar == '360_day':
+        return y * 360 + (m - 1) * 30 + (d - 1)
+    if calendar == '365_day':
+        return y * 365 + CUM_DAYS_365[m - 1] + (d - 1)
+    if calendar == '366_day':
+        return y * 366 + CUM_DAYS_366[m - 1] + (d - 1)
+    if calendar == 'proleptic_gregorian':
+        return _gregorian_jdn(y, m, d)
+    if calendar == 'julian':
+        return _julian_jdn(y, m, d)
+
+    # Standard: Julian before 1582-10-15, Gregorian from then on
+    gregorian = _gregorian_jdn(y, m, d)
+    return np.where(gregorian >= GREGORIAN_START_JDN, gregorian, _julian_jdn(y, m, d))
+
+def ordinal_to_ymd(ordinal, calendar):
+    ordinal = np.asarray(ordinal, dtype=np.int64)
+    calendar = normalise_calendar(calendar)
+
+    if calendar == '360_day':
+        y, rem = np.divmod(ordinal, 360)
+        return y, rem // 30 + 1, rem % 30 + 1
+    if calendar in ('365_day', '366_day'):
+        length, cum = (365, CUM_DAYS_365) if calendar == '365_day' else (366, CUM_DAYS_366)
+        y, doy = np.divmod(ordinal, length)
+        m = np.searchsorted(cum, doy, side='right')
+        return y, m, doy - cum[m - 1] + 1
+    if calendar == 'proleptic_gregorian':
+        return _gregorian_from_jdn(ordinal)
+    if calendar == 'julian':
+        return _julian_from_jdn(ordinal)
+
+    gregorian = _gregorian_from_jdn(ordinal)
+    julian = _julian_from_jdn(ordinal)
+    use_gregorian = ordinal >= GREGORIAN_START_JDN
+    return tuple(np.where(use_gregorian, g, j) for g, j in zip(gregorian, julian))
+
+def month_lengths(y, m, calendar):
+    # Days in each (year, month), taken from the ordinal of the first of the next month
+    y, m = np.asarray(y, dtype=np.int64), np.asarray(m, dtype=np.int64)
+    next_y, next_m = y + m // 12, m % 12 + 1
+    return ymd_to_ordinal(next_y, next_m, 1, calendar) - ymd_to_ordinal(y, m, 1, calendar)
+
+def parse_units(units):
+    # 'days since 1700-01-01 00:00:00' -> ('day', (1700, 1, 1), fraction of a day)
+    units = str(units).strip()
+    if units.lower().startswith('day as %y%m%d'):
+        return 'ymd', None, 0.0
+
+    match = re.match(r"^\s*(\w+?)s?\s+since\s+(-?\d+)-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{1,2})(?::(\d{1,2}(?:\.\d*)?))?)?",
+                     units, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Unsupported units: {units}")
+
+    step = match.group(1).lower()
+    if step not in DAY_FACTORS and step not in ('month', 'year'):
+        raise ValueError(f"Unsupported units: {units}")
+
+    ref = tuple(int(match.group(i)) for i in (2, 3, 4))
+    hour, minute, second = (float(match.group(i) or 0) for i in (5, 6, 7))
+    return step, ref, (hour * 3600 + minute * 60 + second) / 86400
+
+def decode_time_axis(times, units, calendar):
+    # Decode every value of a raw time axis at once.
+    # Returns a dict of arrays: year, month, day, ordinal (fractional days within the calendar) and
+    # valid (False where a value could not be turned into a date, e.g. NaN or a malformed YMD float).
+    times = np.asarray(times, dtype=np.float64).ravel()
+    calendar = normalise_calendar(calendar)
+    step, ref, ref_fraction = parse_units(units)
+    valid = np.isfinite(times)
+    values = np.where(valid, times, 0)
+
+    if step == 'ymd':
+        # 17000101.5 -> 1700-01-01 plus half a day
+        whole = np.floor(values).astype(np.int64)
+        fraction = values - whole
+        y, rest = np.divmod(whole, 10000)
+        m, d = np.divmod(rest, 100)
+        in_range = (m >= 1) & (m <= 12) & (d >= 1)
+        safe_m = np.where(in_range, m, 1)
+        valid &= in_range & (d <= month_lengths(y, safe_m, calendar))
+        ordinal = ymd_to_ordinal(y, safe_m, np.where(valid, d, 1), calendar) + fraction
+
+    elif step == 'month':
+        # Whole months are calendar months, the fractional part is a fraction of that month's length
+        ref_y, ref_m, ref_d = ref
+        whole = np.floor(values).astype(np.int64)
+        total = ref_y * 12 + (ref_m - 1) + whole
+        y, m = total // 12, total % 12 + 1
+        days = (ref_d - 1) + ref_fraction + (values - whole) * month_lengths(y, m, calendar)
+        ordinal = ymd_to_ordinal(y, m, 1, calendar) + days
+
+    elif step == 'year':
+        ref_y, ref_m, ref_d = ref
+        whole = np.floor(values).astype(np.int64)
+        y = ref_y + whole
+        year_length = ymd_to_ordinal(y + 1, 1, 1, calendar) - ymd_to_ordinal(y, 1, 1, calendar)
+        ordinal = ymd_to_ordinal(y, ref_m, ref_d, calendar) + ref_fraction + (values - whole) * year_length
+
+    else:
+        ordinal = ymd_to_ordinal(*ref, calendar) + ref_fraction + values * DAY_FACTORS[step]
+
+    ordinal = np.where(valid, ordinal, np.nan)
+    y, m, d = ordinal_to_ymd(np.floor(np.where(valid, ordinal, 0)), calendar)
+    return {'year': y, 'month': m, 'day': d, 'ordinal': ordinal, 'valid': valid, 'calendar': calendar}
+
+def format_date(decoded, i):
+    if not decoded['valid'][i]:
+        return None
+    return f"{decoded['year'][i]}-{decoded['month'][i]:02d}-{decoded['day'][i]:02d}"
+
+def check_time_axis(decoded):
+    # Gaps, duplicates and backwards steps over the whole axis.
+    # Monthly and annual axes are compared on calendar months/years, since their steps in days vary.
+    ordinal = decoded['ordinal'][decoded['valid']]
+    report = {'n_timesteps': len(decoded['valid']), 'n_invalid': int((~decoded['valid']).sum()),
+              'frequency': None, 'n_gaps': 0, 'n_duplicates': 0, 'n_backwards': 0}
+    if len(ordinal) < 2:
+        return report
+
+    steps = np.diff(ordinal)
+    report['n_duplicates'] = int((steps == 0).sum())
+    report['n_backwards'] = int((steps < 0).sum())
+
+    forward = steps[steps > 0]
+    if len(forward) == 0:
+        return report
+    typical = np.median(forward)
+
+    if 27 <= typical <= 32:
+        report['frequency'] = 'monthly'
+        months = (decoded['year'] * 12 + decoded['month'])[decoded['valid']]
+        report['n_gaps'] = int((np.diff(months) > 1).sum())
+    elif 359 <= typical <= 367:
+        report['frequency'] = 'annual'
+        report['n_gaps'] = int((np.diff(decoded['year'][decoded['valid']]) > 1).sum())
+    else:
+        report['frequency'] = 'daily' if 0.9 <= typical <= 1.1 else f"{typical:g} days"
+        report['n_gaps'] = int((steps > 1.5 * typical).sum())
+
+    return report
+
+def summarise_check(report):
+    # One line for the audit CSVs
+    problems = [f"{report[key]} {label}" for key, label in
+                (('n_invalid', 'invalid'), ('n_gaps', 'gaps'), ('n_duplicates', 'duplicates'), ('n_backwards', 'non-monotonic'))
+                if report[key]]
+    return ", ".join(problems) if problems else "OK"
+
+def to_datetime64(decoded):
+    # datetime64[D] of each timestep, NaT where invalid. Days that do not exist in the real calendar
+    # (e.g. 360_day Feb 30) are clamped to the end of the month.
+    y, m, d = decoded['year'], decoded['month'], decoded['day']
+    d = np.minimum(d, month_lengths(y, m, 'proleptic_gregorian'))
+    days = _gregorian_jdn(y, m, d) - EPOCH_JDN
+    return np.where(decoded['valid'], days.astype('datetime64[D]'), np.datetime64('NaT', 'D'))
+
+# Process-wide registry of decoded axes. Most files share one of a handful of time axes, so each distinct
+# axis is decoded and checked once and every file with it gets the same read-only arrays back.
+_axis_registry = {}
+_axis_lock = threading.Lock()
+_axis_stats = {"hits": 0, "misses": 0}
+
+def axis_signature(times, units, calendar):
+    # (units, calendar, length, first, step) plus a digest of the values, since two axes can share
+    # their first value and step and still differ further on (a gap, a duplicate)
+    times = np.ascontiguousarray(times, dtype=np.float64).ravel()
+    first = float(times[0]) if len(times) else None
+    step = float(times[1] - times[0]) if len(times) > 1 else None
+    digest = hashlib.sha1(times.tobytes()).hexdigest()
+    return (str(units), normalise_calendar(calendar), len(times), first, step, digest)
+
+def _freeze(entry):
+    for value in entry['decoded'].values():
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+    entry['dates'].flags.writeable = False
+    return entry
+
+def decode_axis_cached(times, units, calendar):
+    # Returns {'decoded', 'dates' (datetime64[D]), 'report' (check_time_axis)}, shared between files
+    key = axis_signature(times, units, calendar)
+    with _axis_lock:
+        if key in _axis_registry:
+            _axis_stats["hits"] += 1
+            return _axis_registry[key]
+
+    decoded = decode_time_axis(times, units, calendar)
+    entry = _freeze({'decoded': decoded, 'dates': to_datetime64(decoded), 'report': check_time_axis(decoded)})
+
+    with _axis_lock:
+        _axis_stats["misses"] += 1
+        return _axis_registry.setdefault(key, entry)
+
+def axis_registry_info():
+    with _axis_lock:
+        return dict(_axis_stats, distinct_axes=len(_axis_registry))
+
+def clear_axis_registry():
+    with _axis_lock:
+        _axis_registry.clear()
+        _axis_stats.update(hits=0, misses=0)
+
+def save_axis_registry(path):
+    # Optional on-disk copy so later runs (and other processes) start with every known axis decoded
+    with _axis_lock:
+        entries = [{'key': list(key),
+                    'decoded': {name: (np.where(np.isnan(v), None, v).tolist() if name == 'ordinal' else v.tolist())
+                                if isinstance(v, np.ndarray) else v
+                                for name, v in entry['decoded'].items()},
+                    'report': entry['report']}
+                   for key, entry in _axis_registry.items()]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".json.tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(entries, f)
+    os.replace(tmp, path)
+
+def load_axis_registry(path):
+    if not os.path.isfile(path):
+        return 0
+    with open(path) as f:
+        entries = json.load(f)
+
+    with _axis_lock:
+        for item in entries:
+            decoded = dict(item['decoded'])
+            for name in ('year', 'month', 'day'):
+                decoded[name] = np.array(decoded[name], dtype=np.int64)
+            decoded['ordinal'] = np.array(decoded['ordinal'], dtype=np.float64)
+            decoded['valid'] = np.array(decoded['valid'], dtype=bool)
+            entry = _freeze({'decoded': decoded, 'dates': to_datetime64(decoded), 'report': item['report']})
+            _axis_registry.setdefault(tuple(item['key']), entry)
+    return len(entries)
@@ -0,0 +1,320 @@
+import os
+import json
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cftime
+import netCDF4
+from tqdm import tqdm
+
+from Time_Decode import axis_signature, decode_time_axis
+
+# Header-only scanner for the time variable, built on netCDF4 directly instead of a full xarray dataset.
+# Each file is opened exactly once and every requested probe runs against that same handle,
+# so enabling more checks adds CPU work but no extra file opens. Data variables are never touched.
+
+# name -> (function, needs_time)
+PROBES = {}
+
+# Part of every scan cache key, bump it whenever a probe here changes what it returns
+PROBES_VERSION = 2
+
+def register_probe(name, needs_time = True):
+    # Probes take the shared context and return a dict of fields for the record
+    def decorator(func):
+        PROBES[name] = (func, needs_time)
+        return func
+    return decorator
+
+def time_values(ctx):
+    # Raw (undecoded) time axis, read at most once per file however many probes ask for it
+    if 'time_values' not in ctx:
+        ctx['time_values'] = ctx['time_var'][:]
+    return ctx['time_values']
+
+@register_probe('exists', needs_time=False)
+def probe_exists(ctx):
+    return {'has_time': ctx['time_var'] is not None}
+
+@register_probe('units_calendar')
+def probe_units_calendar(ctx):
+    return {'units': getattr(ctx['time_var'], 'units', None),
+            'calendar': getattr(ctx['time_var'], 'calendar', None)}
+
+@register_probe('timesteps')
+def probe_timesteps(ctx):
+    time_var = ctx['time_var']
+    if time_var.ndim == 0:
+        return {'dtype': str(time_var.dtype), 'n_timesteps': 'unavailable', 'time_start': 'unavailable'}
+
+    n_timesteps = time_var.shape[0]
+    first = time_values(ctx)[0] if 'time_values' in ctx else time_var[0]
+    return {'dtype': str(time_var.dtype), 'n_timesteps': n_timesteps,
+            'time_start': str(first) if n_timesteps else 'unavailable'}
+
+@register_probe('values')
+def probe_values(ctx):
+    return {'time_values': time_values(ctx)}
+
+@register_probe('start_step')
+def probe_start_step(ctx):
+    # Decoded first date and the spacing of the first two steps in days, enough to tell daily/monthly/annual apart.
+    # Time_Decode handles every unit family the TRENDY files use (months/years since, day as %Y%m%d) in any calendar.
+    time_var = ctx['time_var']
+    if time_var.ndim == 0 or time_var.shape[0] == 0 or not hasattr(time_var, 'units'):
+        return {'start_date': None, 'step_days': None}
+
+    head = time_values(ctx)[:2] if 'time_values' in ctx else time_var[:2]
+    try:
+        decoded = decode_time_axis(head, time_var.units, getattr(time_var, 'calendar', None))
+    except ValueError:
+        # Units or calendar Time_Decode does not know
+        return {'start_date': None, 'step_days': None}
+
+    if not decoded['valid'][0]:
+        return {'start_date': None, 'step_days': None}
+    step_days = float(decoded['ordinal'][1] - decoded['ordinal'][0]) if len(head) > 1 and decoded['valid'][1] else None
+    return {'start_date': f"{decoded['year'][0]:04d}-{decoded['month'][0]:02d}-{decoded['day'][0]:02d}",
+            'step_days': step_days}
+
+# axis_signature -> probe_decodes outcome
+_decode_outcomes = {}
+
+@register_probe('decodes', needs_time=False)
+def probe_decodes(ctx):
+    # Same outcome as xr.open_dataset(decode_times=True), which decodes the time variable with cftime
+    time_var = ctx['time_var']
+    if time_var is None or not hasattr(time_var, 'units'):
+        return {'can_decode_times': True, 'decode_error': None}
+    values, calendar = time_values(ctx), getattr(time_var, 'calendar', 'standard')
+
+    # The outcome only depends on the axis, so files sharing one are only decoded once per process
+    try:
+        key = axis_signature(values, time_var.units, calendar)
+    except Exception:
+        key = None
+    if key in _decode_outcomes:
+        return dict(_decode_outcomes[key])
+
+    try:
+        cftime.num2date(values, time_var.units, calendar=calendar)
+        outcome = {'can_decode_times': True, 'decode_error': None}
+    except Exception as e:
+        outcome = {'can_decode_times': False, 'decode_error': str(e)}
+
+    if key is not None:
+        _decode_outcomes[key] = outcome
+    return dict(outcome)
+
+def run_probes(file_path, probes):
+    # Open the file once and merge the output of every probe into one record
+    record = {'error': None}
+
+    try:
+        with netCDF4.Dataset(file_path, "r") as nc:
+            time_var = nc.variables.get('time')
+            if time_var is not None:
+                # Raw values, the same as xarray with decode_times=False
+                time_var.set_auto_maskandscale(False)
+
+            ctx = {'file_path': file_path, 'nc': nc, 'time_var': time_var}
+
+            for name in probes:
+                func, needs_time = PROBES[name]
+                if needs_time and time_var is None:
+                    continue
+                try:
+                    record.update(func(ctx))
+                except Exception as e:
+                    record['error'] = f"{name}: {e}"
+
+    except Exception as e:
+        record['error'] = str(e)
+
+    return record
+
+def time_error_entry(file_path, message):
+    # Input scan record for a file whose probe failed or timed out
+    return {
+        'file_path': file_path,
+        'has_time': False,
+        'calendar': None,
+        'units': None,
+        'dtype': None,
+        'time_start': None,
+        'n_timesteps': None,
+        'start_date': None,
+        'step_days': None,
+        'can_decode_times': None,
+        'error': message
+    }
+
+def time_entry(file_path, probes):
+    # Input scan record of a single file, keyed like the Metadata_DB columns.
+    # Used by both check_timestamps_inputs scripts, bind probes with functools.partial to pass it to scan_files.
+    header = run_probes(file_path, probes)
+    entry = {
+        'file_path': file_path,
+        'has_time': header.get('has_time', False),
+        'calendar': None,
+        'units': None,
+        'dtype': header.get('dtype'),
+        'time_start': header.get('time_start'),
+        'n_timesteps': header.get('n_timesteps'),
+        'start_date': header.get('start_date'),
+        'step_days': header.get('step_days'),
+        # A file that cannot be opened cannot be decoded either, None when decoding was not probed
+        'can_decode_times': header.get('can_decode_times', False) if 'decodes' in probes else None,
+        'error': header['error']
+    }
+
+    if entry['has_time']:
+        entry['calendar'] = header.get('calendar') or 'not_specified'
+        entry['units'] = header.get('units') or 'not_specified'
+
+    return entry
+
+def scan_files(file_paths, probe, error_record, workers = 1, use_processes = True, timeout = None, desc = "Scanning files"):
+    # Run probe(file_path) over every file and return the results in the same order as file_paths.
+    # Work is dominated by filesystem latency. Processes are the default because the netCDF-C library is
+    # not thread-safe unless built that way, concurrent opens from threads can corrupt the heap.
+    # Threads (use_processes=False) are cheaper to start and fine for probes that never touch netCDF4.
+    # A probe that raises, or runs longer than timeout seconds, is replaced by error_record(file_path, message).
+    # After a timeout the remaining files go to a fresh pool, so hung workers can never stall the scan.
+    file_paths = list(file_paths)
+    results = [None] * len(file_paths)
+
+    with tqdm(total=len(file_paths), desc=desc) as pbar:
+        if workers <= 1 and timeout is None:
+            for i, file_path in enumerate(file_paths):
+                try:
+                    results[i] = probe(file_path)
+                except Exception as e:
+                    results[i] = error_record(file_path, str(e))
+                pbar.update(1)
+            return results
+
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        workers = max(workers, 1)
+        queued = list(range(len(file_paths)))[::-1]
+        pool = executor(max_workers=workers)
+        abandoned = []
+        pending = {} # future -> (index, pool, submit time)
+
+        try:
+            while queued or pending:
+                # Files are only handed out when the current pool has a free worker, so the clock starts
+                # when a worker picks the file up rather than when it was queued
+                while queued and sum(p is pool for _, p, _ in pending.values()) < workers:
+                    i = queued.pop()
+                    pending[pool.submit(probe, file_paths[i])] = (i, pool, time.monotonic())
+
+                done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    i = pending.pop(future)[0]
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        results[i] = error_record(file_paths[i], str(e))
+                    pbar.update(1)
+
+                if timeout is None:
+                    continue
+
+                now = time.monotonic()
+                for future, (i, owner, submitted) in list(pending.items()):
+                    if now - submitted <= timeout:
+                        continue
+                    # The worker cannot be interrupted, but the file is recorded and the scan moves on
+                    pending.pop(future)
+                    results[i] = error_record(file_paths[i], f"Timed out after {timeout}s")
+                    pbar.update(1)
+
+                    # A hung worker keeps its slot forever, so the remaining files go to a fresh pool
+                    if owner is pool:
+                        abandoned.append(pool)
+                        pool = executor(max_workers=workers)
+        finally:
+            pool.shutdown(wait=not abandoned, cancel_futures=True)
+            for old in abandoned:
+                # Every healthy probe in these pools has finished, only hung workers are left.
+                # Processes are terminated, hung threads are left to finish on their own.
+                processes = list((getattr(old, "_processes", None) or {}).values())
+                old.shutdown(wait=False, cancel_futures=True)
+                for process in processes:
+                    process.terminate()
+
+    return results
+
+def _json_default(value):
+    # numpy scalars from the probes
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+def load_scan_cache(cache_path):
+    if not os.path.isfile(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+def save_scan_cache(cache, cache_path):
+    # Write then rename so an interrupted audit never corrupts the cache
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".json.tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f, default=_json_default)
+    os.replace(tmp, cache_path)
+
+def _stamp(file_path):
+    try:
+        st = os.stat(file_path)
+        return [st.st_size, st.st_mtime_ns]
+    except OSError:
+        return None
+
+def cached_scan_files(file_paths, probe, error_record, cache_path, probe_key, rescan = False, **scan_kwargs):
+    # scan_files, but files whose (size, mtime) and probe_key match the cache are not probed again.
+    # probe_key should change whenever the checks change (e.g. the PROBES list) so old results are not reused,
+    # changes to the probes in this module are covered by PROBES_VERSION.
+    # Returns the results in file order and the paths that were in the cache but have since been deleted.
+    file_paths = list(file_paths)
+    probe_key = f"{probe_key};probes=v{PROBES_VERSION}"
+    cache = {} if rescan else load_scan_cache(cache_path)
+    stamps = {file_path: _stamp(file_path) for file_path in file_paths}
+
+    stale = [p for p in file_paths
+             if p not in cache or cache[p]['stamp'] != stamps[p] or cache[p]['probe_key'] != probe_key]
+
+    # Failures such as timeouts are likely transient, so they are reported but never cached
+    failed = set()
+    def tagged_error_record(file_path, message):
+        failed.add(file_path)
+        return error_record(file_path, message)
+
+    fresh = scan_files(stale, probe, tagged_error_record, **scan_kwargs)
+    print(f"Probed {len(stale)} new or changed files, {len(file_paths) - len(stale)} served from the scan cache")
+
+    results = {}
+    for file_path in file_paths:
+        if file_path not in stale:
+            cache[file_path]['deleted'] = False
+            results[file_path] = cache[file_path]['result']
+    for file_path, result in zip(stale, fresh):
+        results[file_path] = result
+        if file_path not in failed and stamps[file_path] is not None:
+            cache[file_path] = {'stamp': stamps[file_path], 'probe_key': probe_key, 'result': result, 'deleted': False}
+
+    # Keep deleted files in the cache but flag them so they drop out of the outputs
+    current = set(file_paths)
+    deleted = [p for p, entry in cache.items() if p not in current and not entry.get('deleted')]
+    for file_path in deleted:
+        cache[file_path]['deleted'] = True
+    if deleted:
+        print(f"{len(deleted)} previously scanned files no longer exist")
+
+    save_scan_cache(cache, cache_path)
+
+    return [results[p] for p in file_paths], deleted
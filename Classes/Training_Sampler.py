@@ -0,0 +1,162 @@
+import queue
+import threading
+from collections import defaultdict
+
+import numpy as np
+import netCDF4
+
+import paths
+from File_Index import build_file_index, report_duplicates
+from Land_Mask import data_variable, missing_values
+
+# Random-access minibatches for the emulator, straight from the standardised outputs.
+# A sample is one land pixel of one model/scenario and a window of consecutive months, with one feature per
+# variable. Batches come back as contiguous (batch, time, features) float32 arrays, assembled by a background
+# thread that keeps every file open and stays a few batches ahead of training.
+# All netCDF4 reads happen on that one thread, since the netCDF-C library is not thread-safe.
+
+def build_sample_index(variables, root = paths.STD_TIME_OUTPUT, models = None, scenarios = None):
+    # Every model/scenario that has all the requested variables, with each variable's path and time length
+    kwargs = {} if scenarios is None else {"scenarios": scenarios}
+    index, duplicates = build_file_index(root, models=models, variables=variables, **kwargs)
+    report_duplicates(duplicates)
+
+    grouped = defaultdict(dict)
+    for (model, scenario, var), path in index.items():
+        grouped[(model, scenario)][var] = path
+
+    groups = []
+    for (model, scenario), files in sorted(grouped.items()):
+        missing = [var for var in variables if var not in files]
+        if missing:
+            print(f"Skipping {model}/{scenario}, missing {', '.join(missing)}")
+            continue
+
+        # The netCDF variable inside a file is not always named like the requested variable
+        with netCDF4.Dataset(files[variables[0]]) as nc:
+            var = data_variable(nc, files[variables[0]])
+            # Raw packed values, so the comparison with the fill values is not thrown off by scale_factor/add_offset
+            var.set_auto_maskandscale(False)
+            # Land pixels are the ones with data in the first timestep
+            first = np.asarray(var[0], dtype=np.float64)
+            land = np.isfinite(first) & ~np.isin(first, missing_values(var))
+            if land.ndim > 2:
+                land = land.reshape(-1, *land.shape[-2:]).any(axis=0)
+
+        if not land.any():
+            print(f"Skipping {model}/{scenario}, no land cells in {files[variables[0]]}")
+            continue
+
+        names, lengths = {}, {}
+        for name in variables:
+            with netCDF4.Dataset(files[name]) as nc:
+                var = data_variable(nc, files[name])
+                names[name], lengths[name] = var.name, var.shape[0]
+        n_time = max(lengths.values())
+
+        groups.append({"model": model, "scenario": scenario, "files": [files[v] for v in variables],
+                       "names": [names[v] for v in variables], "lengths": [lengths[v] for v in variables],
+                       "n_time": n_time, "land": np.argwhere(land)})
+
+    if not groups:
+        raise ValueError(f"No model/scenario has land cells and all of {', '.join(variables)}.")
+    return {"variables": list(variables), "groups": groups}
+
+def draw_samples(index, batch_size, window, rng):
+    # (group, lat, lon, start) rows, groups weighted by their number of land pixels
+    groups = index["groups"]
+    if window < 1:
+        raise ValueError(f"window must be at least 1 timestep, got {window}.")
+    short = [f"{g['model']}/{g['scenario']} ({g['n_time']} timesteps)" for g in groups if g["n_time"] < window]
+    if short:
+        raise ValueError(f"window of {window} timesteps is longer than the record of {', '.join(short)}.")
+    weights = np.array([len(g["land"]) for g in groups], dtype=np.float64)
+    if weights.sum() == 0:
+        raise ValueError("The sample index has no land cells to draw from.")
+    group_ids = rng.choice(len(groups), size=batch_size, p=weights / weights.sum())
+
+    samples = np.empty((batch_size, 4), dtype=np.int64)
+    for row, g in enumerate(group_ids):
+        group = groups[g]
+        lat, lon = group["land"][rng.integers(len(group["land"]))]
+        samples[row] = (g, lat, lon, rng.integers(0, group["n_time"] - window + 1))
+
+    # Reading in file and row order keeps neighbouring samples in the same chunks
+    return samples[np.lexsort((samples[:, 2], samples[:, 1], samples[:, 0]))]
+
+def read_batch(index, samples, window, handles):
+    # handles maps path -> open netCDF4 variable, reused across batches
+    batch = np.empty((len(samples), window, len(index["variables"])), dtype=np.float32)
+
+    for row, (g, lat, lon, start) in enumerate(samples):
+        group = index["groups"][g]
+        for f, (path, name, length) in enumerate(zip(group["files"], group["names"], group["lengths"])):
+            if path not in handles:
+                var = netCDF4.Dataset(path).variables[name]
+                var.set_auto_maskandscale(True)
+                handles[path] = var
+            var = handles[path]
+
+            if length == group["n_time"]:
+                series = var[start:start + window, ..., lat, lon]
+            else:
+                # Coarser variables (annual alongside monthly) are repeated onto the finer axis
+                step = group["n_time"] // length
+                series = np.repeat(var[start // step:(start + window - 1) // step + 1, ..., lat, lon], step, axis=0)
+                offset = start % step
+                series = series[offset:offset + window]
+
+            series = np.ma.filled(series.astype(np.float32), np.nan)
+            # Extra dimensions (e.g. PFT levels) are averaged into one feature
+            batch[row, :, f] = series.reshape(window, -1).mean(axis=1) if series.ndim > 1 else series
+
+    return batch
+
+def iter_batches(index, batch_size, window, n_batches = None, prefetch = 4, seed = 0):
+    # Yields (batch, samples), batch is (batch_size, window, n_variables) float32 and samples its (group, lat, lon, start) rows
+    batches = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def producer():
+        rng = np.random.default_rng(seed)
+        handles = {}
+        produced = 0
+        try:
+            while not stop.is_set() and (n_batches is None or produced < n_batches):
+                samples = draw_samples(index, batch_size, window, rng)
+                item = (read_batch(index, samples, window, handles), samples)
+                while not stop.is_set():
+                    try:
+                        batches.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                produced += 1
+        except Exception as e:
+            batches.put(e)
+        finally:
+            for var in handles.values():
+                var.group().close()
+            batches.put(done)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = batches.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Stopped early (break in the training loop), let the producer finish and close its files
+        stop.set()
+        while thread.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
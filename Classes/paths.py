@@ -19,4 +19,10 @@ TRENDY_CLUSTER = "/Net/Groups/BGI/data/DataStructureMDI/DATA/Incoming/trendy/gcb
 # Outputs
 OUTPUTS = f"{BASE}/Outputs"
 CSV = f"{OUTPUTS}/CSVs"
-GRAPHS = f"{OUTPUTS}/Graphs"
\ No newline at end of file
+GRAPHS = f"{OUTPUTS}/Graphs"
+PIXEL_CACHE = f"{OUTPUTS}/Pixel_Cache"
+METADATA_DB = f"{CSV}/Timesteps/time_metadata.sqlite"
+TIME_METADATA_STORE = f"{CSV}/time_metadata.parquet" # Long-format time metadata of the standardised outputs, wide CSVs sit next to it
+STANDARDISE_STATS = f"{OUTPUTS}/Standardisation"
+ENSEMBLE = f"{TRENDY}/Ensemble"
+LAND_MASK = f"{OUTPUTS}/Land_Mask/land_mask.npz"
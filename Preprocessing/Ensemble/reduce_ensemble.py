@@ -0,0 +1,44 @@
+# Run it in bash like this: python reduce_ensemble.py --variable gpp npp --scenario S3
+# Ensemble mean, std, min/max and quantiles across the TRENDY models for every variable and scenario,
+# streamed one block of timesteps and one model at a time. Writes <variable>_<scenario>_ensemble.nc under paths.ENSEMBLE.
+
+import argparse
+import os
+import sys
+from tqdm import tqdm
+
+# Add the directory of the classes
+sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
+import paths
+from Ensemble import ENSEMBLE_MODELS, ensemble_files, reduce_ensemble
+from Land_Mask import cached_land_mask
+
+VARIABLES = ["mrso", "mrro", "evapotrans", "evapo", "cVeg", "cLitter",
+             "cSoil", "gpp", "ra", "npp", "rh", "fFire", "fLuc", "nbp",
+             "landCoverFrac", "burntArea", "lai"]
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming ensemble statistics of the standardised TRENDY outputs')
+    parser.add_argument('--variable', nargs='+', default=VARIABLES)
+    parser.add_argument('--scenario', nargs='+', default=['S0', 'S1', 'S2', 'S3'])
+    parser.add_argument('--model', nargs='+', default=ENSEMBLE_MODELS, help='Ensemble members, defaults to all 18 models')
+    parser.add_argument('--quantiles', nargs='+', type=float, default=[0.1, 0.5, 0.9])
+    parser.add_argument('--time-chunk', type=int, default=12, help='Timesteps per block, memory scales with this')
+    parser.add_argument('--land-only', action='store_true', help='Only reduce the land cells, from the cached mask of each variable')
+    args = parser.parse_args()
+
+    for var in args.variable:
+        for scenario in args.scenario:
+            files = ensemble_files(var, scenario, models=args.model)
+            if not files:
+                tqdm.write(f"No files for {var} {scenario}")
+                continue
+
+            # Land where any of these models has this variable, built once and cached
+            land = cached_land_mask(variables=[var], models=args.model) if args.land_only else None
+            output_path = os.path.join(paths.ENSEMBLE, scenario, f"{var}_{scenario}_ensemble.nc")
+            members = reduce_ensemble(files, output_path, quantiles=args.quantiles, time_chunk=args.time_chunk, land=land)
+            tqdm.write(f"{var} {scenario}: {len(members)} models -> {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# Run it in bash like this: python build_land_mask.py --rebuild
+# Builds the land mask of the common grid from the standardised outputs and caches it at paths.LAND_MASK
+# (or next to it for a selection of models/variables).
+# Later calls of Land_Mask.cached_land_mask load it straight from there until a standardised file changes.
+# Prints the number of land cells and how much smaller a compact (time, n_land) array is than the full grid.
+
+import argparse
+import os
+import sys
+
+# Add the directory of the classes
+sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
+import paths
+from Land_Mask import cached_land_mask, mask_path, n_land
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and cache the land mask of the standardised TRENDY outputs')
+    parser.add_argument('--model', nargs='+', default=None, help='Models to build the mask from, defaults to all')
+    parser.add_argument('--variable', nargs='+', default=None, help='Variables to build the mask from, defaults to all')
+    parser.add_argument('--rule', choices=['any', 'all'], default='any', help='Land where any file (or every file) has data')
+    parser.add_argument('--output', default=None, help='npz to write, defaults to the cache file of the selection')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild even if the cached mask is up to date')
+    args = parser.parse_args()
+
+    output = args.output or mask_path(args.variable, args.model, args.rule)
+    land = cached_land_mask(models=args.model, variables=args.variable, rule=args.rule, path=output, rebuild=args.rebuild)
+
+    n_cells = land["mask"].size
+    print(f"{n_land(land)} land cells of {n_cells} ({100 * n_land(land) / n_cells:.1f}%)")
+    print(f"Compact arrays are {n_cells / n_land(land):.1f}x smaller than the full grid")
+    print(f"Saved to {output}")
+
+if __name__ == "__main__":
+    main()
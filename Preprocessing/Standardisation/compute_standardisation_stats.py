@@ -0,0 +1,60 @@
+# Run it in bash like this: python compute_standardisation_stats.py --workers 8
+# One streaming pass over every standardised file, accumulating the mean/std of each variable across all
+# models and scenarios (and, with --per-pixel, of every pixel). Only one block of timesteps per worker is in memory.
+# The states are saved as an npz, Standardise.load_stats + finalize_stats give the mean/std for standardize_chunk/inverse_standardize_chunk.
+
+import argparse
+import os
+import sys
+
+# Add the directory of the classes
+sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
+import paths
+from File_Index import build_file_index, report_duplicates
+from Standardise import stats_over_files, finalize_stats, save_stats
+from Land_Mask import cached_land_mask
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming mean/std of the standardised TRENDY outputs')
+    parser.add_argument('--model', nargs='+', default=None, help='Models to include, defaults to all')
+    parser.add_argument('--scenario', nargs='+', default=['S0', 'S1', 'S2', 'S3'])
+    parser.add_argument('--variable', nargs='+', default=None, help='Variables to include, defaults to all')
+    parser.add_argument('--per-pixel', action='store_true', help='Keep one mean/std per pixel instead of one per variable')
+    parser.add_argument('--years-after-1900', type=int, default=None, help='Only use timesteps from 1900 + this many years')
+    parser.add_argument('--time-chunk', type=int, default=120, help='Timesteps read at once')
+    parser.add_argument('--workers', type=int, default=1, help='Files reduced in parallel')
+    parser.add_argument('--land-only', action='store_true', help='Only read the land cells of the selected files, per-pixel states are then (n_land,) and carry their mask')
+    parser.add_argument('--output', default=None, help='npz to write, defaults to the per_variable/per_pixel file in paths.STANDARDISE_STATS')
+    args = parser.parse_args()
+
+    index, duplicates = build_file_index(paths.STD_TIME_OUTPUT, models=args.model, scenarios=args.scenario, variables=args.variable)
+    report_duplicates(duplicates)
+
+    land = cached_land_mask(variables=args.variable, models=args.model) if args.land_only else None
+
+    files_by_var = {}
+    for (_, _, var), path in sorted(index.items()):
+        files_by_var.setdefault(var, []).append(path)
+
+    stats = {}
+    for var, file_paths in files_by_var.items():
+        state = stats_over_files(file_paths, per_pixel=args.per_pixel, years_after_1900=args.years_after_1900,
+                                 time_chunk=args.time_chunk, workers=args.workers, land=land)
+        if state is None:
+            print(f"{var}: no timesteps left after trimming, skipped")
+            continue
+        # The raw state is saved so later runs (e.g. new models) can be merged in with merge_stats
+        stats[var] = state
+        mean, std = finalize_stats(state)
+        if not args.per_pixel:
+            print(f"{var}: {len(file_paths)} files, n={int(state['count'])}, mean={float(mean):.6g}, std={float(std):.6g}")
+        else:
+            print(f"{var}: {len(file_paths)} files")
+
+    name = "per_pixel" if args.per_pixel else "per_variable"
+    output = args.output or os.path.join(paths.STANDARDISE_STATS, f"{name}_land.npz" if args.land_only else f"{name}.npz")
+    save_stats(stats, output)
+    print(f"Saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ print("Starting script")
 # Directories
 sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
 import paths
+from Metadata_Store import read_store, wide_view
 
 csv_dir = "/Net/Groups/BSI/work_scratch/ecathain/mpi2/Outputs/CSVs/Timesteps/Outputs/STD_TIME"
 plot_dir = "/Net/Groups/BSI/work_scratch/ecathain/mpi2/Outputs/Graphs/Standard_Time"
@@ -31,11 +32,18 @@ list_titles = [
 dict_csv_paths = {k: os.path.join(csv_dir, f"{k}.csv") for k in list_keys}
 dict_plot_paths = {k: os.path.join(plot_dir, f"{k}.csv") for k in list_keys}
 
-# Load CSVs into dictionary
+# Load into dictionary, from the long-format store if the scanner wrote one, otherwise from the CSVs
+store_path = paths.TIME_METADATA_STORE # Written by check_timestamps_outputs_decode.py and the time conversion
 df_dict = {}
-for key, path in dict_csv_paths.items():
-    if os.path.isfile(path):
-        df_dict[key] = pd.read_csv(path, index_col=0)
+if os.path.isfile(store_path):
+    store = read_store(store_path)
+    for key in list_keys:
+        if key in store.columns:
+            df_dict[key] = wide_view(store, key)
+else:
+    for key, path in dict_csv_paths.items():
+        if os.path.isfile(path):
+            df_dict[key] = pd.read_csv(path, index_col=0)
 
 # Titles
 dict_titles = dict(zip(list_keys, list_titles))
@@ -2,6 +2,10 @@ import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import sys
+
+sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
+from Metadata_Store import read_store, wide_view
 
 print("Starting script")
 
@@ -11,8 +15,8 @@ plot_dir = "/Net/Groups/BSI/work_scratch/ecathain/mpi2/Outputs/Graphs/Timesteps"
 
 # Save the paths
 # Store all data to collect in a list
-list_keys = ['Exists', 'Units', 'Calendar', 'Num_Timesteps', 'Interval', 'dtype', 'date_range']    
-list_titles = ["Presence of Time Variable", "Unit of Time", "Calendar Type", "Number of Timesteps", "Average Interval of Time", "Data Type of Time", 'date_range']         
+list_keys = ['Exists', 'Units', 'Calendar', 'Num_Timesteps', 'Interval', 'dtype', 'date_range', 'axis_check']    
+list_titles = ["Presence of Time Variable", "Unit of Time", "Calendar Type", "Number of Timesteps", "Average Interval of Time", "Data Type of Time", 'date_range', "Gaps, Duplicates and Backwards Steps"]         
 
 # Store all paths in a dictionary
 dict_csv_paths = {}
@@ -23,11 +27,18 @@ dict_plot_paths = {}
 for i in list_keys:
     dict_plot_paths[i] = os.path.join(plot_dir, f"{i}.csv")
 
-# Check if the CSV exists, if so read it in and if not create it. Store as a dictionary.
+# Build each table from the long-format store if the scanner wrote one, otherwise read the CSVs. Store as a dictionary.
+store_path = os.path.join(csv_dir, "time_metadata.parquet")
 df_dict = {}
-for key, path in dict_csv_paths.items():
-    if os.path.isfile(path):
-        df_dict[key] = pd.read_csv(path, index_col=0)
+if os.path.isfile(store_path):
+    store = read_store(store_path)
+    for key in list_keys:
+        if key in store.columns:
+            df_dict[key] = wide_view(store, key)
+else:
+    for key, path in dict_csv_paths.items():
+        if os.path.isfile(path):
+            df_dict[key] = pd.read_csv(path, index_col=0)
 
 
 dict_titles = dict(zip(list_keys, list_titles))
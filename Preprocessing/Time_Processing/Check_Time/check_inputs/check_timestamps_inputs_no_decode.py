@@ -1,14 +1,28 @@
+import argparse
 import os
+from functools import partial
 import xarray as xr
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 from tqdm import tqdm  # <-- Progress bar
+import sys
 
-def analyze_netcdf_time(root_dir):
+# Add the directory of the classes
+sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
+import paths
+from File_Index import keys_from_path
+from Metadata_DB import upsert_records, remove_files
+from Time_Scan import time_entry, time_error_entry, scan_files, cached_scan_files
+
+# Checks run against each file, all from a single open
+PROBES = ['exists', 'units_calendar', 'timesteps', 'start_step']
+
+# Header-only read of the time variable, no xarray dataset is built
+analyze_file = partial(time_entry, probes=PROBES)
+
+def analyze_netcdf_time(root_dir, workers=1, use_processes=True, timeout=None, cache_path=None, rescan=False, db_path=None):
     """Recursively analyze NetCDF files for time dimension properties."""
-    results = []
-    
     # Collect all .nc files
     all_nc_files = []
     for root, dirs, files in os.walk(root_dir):
@@ -16,50 +30,38 @@ def analyze_netcdf_time(root_dir):
             if file.endswith('.nc'):
                 all_nc_files.append(os.path.join(root, file))
     
-    # Process each .nc file with a progress bar
-    for file_path in tqdm(all_nc_files, desc="Analyzing NetCDF files"):
-        entry = {
-            'file_path': file_path,
-            'has_time': False,
-            'calendar': None,
-            'units': None,
-            'dtype': None,
-            'time_start': None,
-            'n_timesteps': None,
-            'can_decode_times': None,
-            'error': None
-        }
-
-        try:
-            with xr.open_dataset(file_path, decode_times=False) as ds:
-                if 'time' in ds.variables:
-                    time_var = ds['time']
-                    entry['has_time'] = True
-                    entry['dtype'] = str(time_var.dtype)
-
-                    try:
-                        entry['time_start'] = str(time_var.values[0])
-                    except Exception:
-                        entry['time_start'] = 'unavailable'
-
-                    try:
-                        entry['n_timesteps'] = len(time_var)
-                    except Exception:
-                        entry['n_timesteps'] = 'unavailable'
-
-                    entry['calendar'] = time_var.encoding.get('calendar', time_var.attrs.get('calendar', 'not_specified'))
-                    entry['units'] = time_var.encoding.get('units', time_var.attrs.get('units', 'not_specified'))
-        except Exception as e:
-            entry['error'] = str(e)
+    # Probe each .nc file, in parallel if requested, results come back in file order
+    scan_kwargs = dict(workers=workers, use_processes=use_processes, timeout=timeout, desc="Analyzing NetCDF files")
+    deleted = []
+    if cache_path is None:
+        results = scan_files(all_nc_files, analyze_file, time_error_entry, **scan_kwargs)
+    else:
+        # Only new or changed files are probed again, the rest come from the previous audit
+        results, deleted = cached_scan_files(all_nc_files, analyze_file, time_error_entry, cache_path,
+                                             probe_key=",".join(PROBES), rescan=rescan, **scan_kwargs)
+    
+    # model/scenario/variable from the INPUT layout, so the index can be queried by them
+    results = [dict(result, **keys_from_path(file_path, root_dir)) for file_path, result in zip(all_nc_files, results)]
 
-        results.append(entry)
+    # Keep the queryable index in step with the scan
+    if db_path is not None:
+        upsert_records(results, source='inputs', db_path=db_path)
+        remove_files(deleted, db_path=db_path)
     
     return pd.DataFrame(results)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scan the time metadata of every NetCDF file under the TRENDY inputs')
+    parser.add_argument('--workers', type=int, default=1, help='Number of files probed at once')
+    parser.add_argument('--threads', action='store_true', help='Use threads instead of processes, only safe with a thread-safe netCDF-C build')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds before a hung file is recorded as an error')
+    parser.add_argument('--rescan', action='store_true', help='Ignore the scan cache and probe every file again')
+    args = parser.parse_args()
+
     root_directory = "/Net/Groups/BSI/work_scratch/ecathain/mpi2/TRENDY/Raw/INPUT"
+    cache_path = "/Net/Groups/BSI/work_scratch/ecathain/mpi2/Outputs/CSVs/Timesteps/Inputs/Current/inputs_scan_cache_no_decode.json"
     
-    df = analyze_netcdf_time(root_directory)
+    df = analyze_netcdf_time(root_directory, args.workers, not args.threads, args.timeout, cache_path, args.rescan, paths.METADATA_DB)
 
     df.to_csv('/Net/Groups/BSI/work_scratch/ecathain/mpi2/Outputs/CSVs/Timesteps/Inputs/Current/inputs_timestamps_with_num_timesteps.csv', index=False)
 
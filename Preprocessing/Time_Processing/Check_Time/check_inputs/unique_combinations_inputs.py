@@ -1,21 +1,16 @@
-import pandas as pd
+import os
+import sys
 
-# Load the CSV
-df = pd.read_csv("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Outputs/CSVs/Timesteps/inputs_timestamp_info.csv")  # Replace with your actual filename
+# Add the directory of the classes
+sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
+from Metadata_DB import example_per_combo, COMBO_COLUMNS
 
-# Define the columns to compare for uniqueness
-key_cols = ['has_time', 'calendar', 'units', 'dtype']
-
-# Drop rows with missing key info (optional, depending on your data quality)
-df_filtered = df.dropna(subset=key_cols + ['file_path'])
-
-# Group by the unique combinations and get the first file_path as example
-example_map = df_filtered.groupby(key_cols)['file_path'].first().reset_index()
-
-# Rename the file_path column to 'example_file'
-example_map = example_map.rename(columns={'file_path': 'example_file'})
+# Populated by check_timestamps_inputs_*.py, the grouping runs in SQLite instead of over the whole CSV
+# Rows with missing key info are dropped (optional, depending on your data quality)
+example_map = example_per_combo(COMBO_COLUMNS, source='inputs')
+example_map = example_map.dropna(subset=COMBO_COLUMNS)
 
 # Save to a new CSV
 example_map.to_csv("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Outputs/CSVs/Timesteps/inputs_unique_combos.csv", index=False)
 
-print(f"✅ Found {len(example_map)} unique combinations.")
\ No newline at end of file
+print(f"✅ Found {len(example_map)} unique combinations.")
@@ -1,19 +1,25 @@
+import argparse
 import os
 import pandas as pd
 import xarray as xr
-import cftime
+import numpy as np
 from tqdm import tqdm
-from cftime import _parse_date
 import sys
 
-# This script doesn't succeed in decoding all time units
+# Every timestep of every file is decoded (Time_Decode.py) and checked for gaps, duplicates and backwards steps
 
 # Add the directory of the classes
 sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
 import paths
+from File_Index import build_file_index, report_duplicates, files_by_model_scenario
+from Metadata_DB import upsert_records, remove_files
+from Metadata_Store import TIME_PRESENT, records_to_frame, store_lock, merge_store, read_store, write_wide_csvs
+from Time_Decode import decode_axis_cached, format_date, summarise_check
+from Time_Scan import register_probe, run_probes, time_values, cached_scan_files
 
 INPUT_DIR = paths.STD_TIME_OUTPUT # This is where the data to be analysed is. Target the folder which contains the models as directories
 OUTPUT_DIR = paths.CSV # This is where the CSVs will be written
+STORE_PATH = paths.TIME_METADATA_STORE # Long-format table the CSVs are derived from, also updated by the time conversion
 SCENARIOS = ['S0', 'S1', 'S2', 'S3']
 check_decodes = False  # Set to True to enable decoding validation
 
@@ -21,10 +27,21 @@ print(INPUT_DIR)
 
 # Dynamic CSV keys based on check_decodes flag
 CSV_KEYS = ['Exists', 'Units', 'Calendar', 'Num_Timesteps', 
-            'Interval', 'dtype', 'date_range']
+            'Interval', 'dtype', 'date_range', 'axis_check']
 if check_decodes:
     CSV_KEYS.insert(6, 'decodes')  # Insert at position 6
 
+# Store fields under their index column names
+DB_COLUMNS = {'Units': 'units', 'Calendar': 'calendar', 'Num_Timesteps': 'n_timesteps'}
+
+# Checks run against each file, all from a single open
+PROBES = ['exists', 'units_calendar', 'timesteps', 'start_step', 'date_range']
+if check_decodes:
+    PROBES.append('decodes')
+
+# Scan cache key, bump the parse version whenever parse_dates or probe_date_range change what they return
+PROBE_KEY = ",".join(PROBES) + ";parse=v2"
+
 def setup_directories():
     """Create output directory if needed"""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -43,237 +60,144 @@ def get_models_vars():
 
 def build_model_scenarios(models):
     """Create dictionary of model/scenario file listings"""
-    model_scenarios = {}
-    for model in models:
-        for scenario in SCENARIOS:
-            path = os.path.join(INPUT_DIR, model, scenario)
-            if not os.path.exists(path):
-                continue
-            
-            # Find relevant NetCDF files
-            files = [f for f in os.listdir(path) 
-                    if f.endswith('.nc') and any(f'_{var}.nc' in f for var in variables)]
-            
-            model_scenarios[f"{model}/{scenario}"] = files
-    return model_scenarios
-
-def initialize_dataframes(variables):
-    """Create or load existing DataFrames"""
-    dfs = {}
-    for key in CSV_KEYS:
-        path = os.path.join(OUTPUT_DIR, f"{key}.csv")
-        if os.path.exists(path):
-            dfs[key] = pd.read_csv(path, index_col=0)
-        else:
-            dfs[key] = pd.DataFrame(index=variables)
-    return dfs
+    # One walk of INPUT_DIR shared with the conversion script, ambiguous matches are reported
+    index, duplicates = build_file_index(INPUT_DIR, models=models, scenarios=SCENARIOS, variables=variables)
+    report_duplicates(duplicates)
+    return files_by_model_scenario(index)
 
-def parse_dates(time_var):
-    """Convert time variable to start/end dates using native calendar"""
+def parse_dates(times, units, calendar):
+    """Decode the whole time axis in one vectorised pass, return the start/end dates and the axis check"""
     try:
-        times = time_var.values
         if times.size == 0:
-            return "Empty dataset", "Empty dataset"
-
-        units = str(time_var.units)
-        calendar = str(time_var.calendar)
-        first, last = None, None
-
-        # Handle special case units
-        if "day as %Y%m%d.%f" in units:
-            def parse_ymdfloat(value):
-                try:
-                    date_float = float(value)
-                    date_int = int(date_float)
-                    year = date_int // 10000
-                    month = (date_int % 10000) // 100
-                    day = date_int % 100
-                    
-                    # Handle CLM5.0's zero dates
-                    if year == 0 or month == 0 or day == 0:
-                        return "Zero date not allowed"
-                        
-                    # Validate using actual calendar
-                    return cftime.datetime(year, month, day, 
-                                         calendar=calendar,
-                                         has_year_zero=True)
-                except ValueError:
-                    return "Invalid YMD format"
-
-            first = parse_ymdfloat(times[0])
-            last = parse_ymdfloat(times[-1])
-
-        elif 'years' in units:
-            try:
-                # Robust base year extraction
-                date_part = units.split('since')[-1].strip()
-                parsed = cftime._parse_date(date_part)
-                base_year = parsed[0]  # Get year from parsed tuple
-                base_date = cftime.datetime(base_year, 1, 1, calendar=calendar)
-                
-                # Handle iMAPLE's "years since 1700" 
-                days = times * 365.2425  # Average year length
-                first = base_date + datetime.timedelta(days=float(days[0]))
-                last = base_date + datetime.timedelta(days=float(days[-1]))
-            except Exception as e:
-                return f"Year Error: {str(e)}", f"Year Error: {str(e)}"
-
-        elif 'months' in units:
-            try:
-                if calendar == '360_day':
-                    first = cftime.num2date(times[0], units, calendar=calendar)
-                    last = cftime.num2date(times[-1], units, calendar=calendar)
-                else:
-                    # Handle CABLE-POP's non-360_day calendars
-                    date_part = units.split('since')[-1].strip()
-                    parsed = cftime._parse_date(date_part)
-                    base_date = cftime.datetime(*parsed[:6], calendar=calendar)
-                    
-                    days = times * 30.4368  # Average month length
-                    first = base_date + datetime.timedelta(days=float(days[0]))
-                    last = base_date + datetime.timedelta(days=float(days[-1]))
-            except Exception as e:
-                return f"Month Error: {str(e)}", f"Month Error: {str(e)}"
+            return "Empty dataset", "Empty dataset", None
+
+        # Files sharing an axis share one decode and check
+        axis = decode_axis_cached(times, units, calendar)
+        decoded = axis['decoded']
+
+        def safe_format(i):
+            date = format_date(decoded, i)
+            if date is not None:
+                return date
+            if "day as %Y%m%d" not in str(units) or not np.isfinite(times[i]):
+                return "Invalid time value"
+            # Handle CLM5.0's zero dates
+            ymd = int(times[i])
+            if 0 in (ymd // 10000, (ymd // 100) % 100, ymd % 100):
+                return "Zero date not allowed"
+            return "Invalid YMD format"
+
+        return safe_format(0), safe_format(-1), axis['report']
 
-        else:
-            try:
-                first = cftime.num2date(times[0], units, calendar=calendar)
-                last = cftime.num2date(times[-1], units, calendar=calendar)
-            except Exception as e:
-                return f"Standard Error: {str(e)}", f"Standard Error: {str(e)}"
-
-        def safe_format(d):
-            if isinstance(d, cftime.datetime):
-                return f"{d.year}-{d.month:02d}-{d.day:02d}"
-            return str(d)
+    except Exception as e:
+        return f"Decode Error: {str(e)}", f"Decode Error: {str(e)}", None
 
-        return safe_format(first), safe_format(last)
+@register_probe('date_range')
+def probe_date_range(ctx):
+    """Start/end dates of the time axis, from the handle the other probes share"""
+    time_var = ctx['time_var']
+    units = getattr(time_var, 'units', None)
 
-    except Exception as e:
-        return f"General Error: {str(e)}", f"General Error: {str(e)}"
+    # Skip invalid entries
+    if str(units) in ['No Calendar', 'File Doesnt Exist']:
+        return {'date_range': None}
 
-def check_decoding(file_path):
-    """Validate time decoding capability"""
-    try:
-        with xr.open_dataset(file_path) as ds:
-            _ = ds.time.values
-        return "Decodes successfully"
-    except Exception as e:
-        return f"Decoding failed: {str(e)}"
+    start_date, end_date, report = parse_dates(time_values(ctx), units, getattr(time_var, 'calendar', None))
+    return {'date_range': f"{start_date} : {end_date}",
+            'axis_check': summarise_check(report) if report is not None else "Not checked"}
 
 def process_file(file_path):
     """Extract metadata and date range from a NetCDF file"""
-    try:
-        with xr.open_dataset(file_path, decode_times=False) as ds:
-            if 'time' not in ds:
-                return {'date_range': 'Time dimension missing'}
-            
-            time_var = ds.time
-            metadata = {
-                'Exists': 'Time exists',
-                'Units': str(time_var.units),
-                'Calendar': str(time_var.calendar),
-                'Num_Timesteps': len(time_var),
-                'Interval': 'Calculated in main loop',
-                'dtype': str(time_var.dtype),
-                'date_range': None
-            }
-            
-            if check_decodes:
-                metadata['decodes'] = check_decoding(file_path)
-            
-            # Skip invalid entries
-            if metadata['Units'] in ['No Calendar', 'File Doesnt Exist']:
-                return metadata
-                
-            # Get date range
-            start_date, end_date = parse_dates(time_var)
-            metadata['date_range'] = f"{start_date} : {end_date}"
-            
-            return metadata
-            
-    except Exception as e:
-        return {'date_range': f"File error: {str(e)}"}
+    # One header-only open of the file, every check runs against the same handle
+    header = run_probes(file_path, PROBES)
+
+    if 'has_time' not in header:
+        return {'date_range': f"File error: {header['error']}"}
+
+    if not header['has_time']:
+        return {'date_range': 'Time dimension missing'}
+
+    metadata = {
+        'Exists': TIME_PRESENT,
+        'Units': str(header.get('units')),
+        'Calendar': str(header.get('calendar')),
+        'Num_Timesteps': header.get('n_timesteps'),
+        'Interval': 'Calculated in main loop',
+        'dtype': header.get('dtype'),
+        'date_range': header.get('date_range', f"Probe error: {header['error']}"),
+        'axis_check': header.get('axis_check'),
+        'start_date': header.get('start_date'),
+        'step_days': header.get('step_days')
+    }
+
+    if check_decodes:
+        if header.get('can_decode_times'):
+            metadata['decodes'] = "Decodes successfully"
+        else:
+            metadata['decodes'] = f"Decoding failed: {header.get('decode_error')}"
+
+    return metadata
+
+def error_metadata(file_path, message):
+    """Record for a file whose probe failed or timed out"""
+    return {'date_range': f"File error: {message}"}
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract the time metadata of every TRENDY output file')
+    parser.add_argument('--workers', type=int, default=1, help='Number of files probed at once')
+    parser.add_argument('--threads', action='store_true', help='Use threads instead of processes, only safe with a thread-safe netCDF-C build')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds before a hung file is recorded as an error')
+    parser.add_argument('--rescan', action='store_true', help='Ignore the scan cache and probe every file again')
+    args = parser.parse_args()
+
     print("Starting date range extraction...")
     setup_directories()
     models, variables = get_models_vars()
     model_scenarios = build_model_scenarios(models)
-    dfs = initialize_dataframes(variables)
     
-    total_files = sum(len(files) for files in model_scenarios.values())
+    # Flatten into one ordered list so results map back to the same cells whatever order they finish in
+    entries = []
+    for scenario_path, files in model_scenarios.items():
+        model, scenario = scenario_path.split('/')
+        for file in files:
+            var = file.split('_')[-1].replace('.nc', '')
+            entries.append((model, scenario, var, os.path.join(INPUT_DIR, model, scenario, file)))
     
-    with tqdm(total=total_files, desc="Processing files") as pbar:
-        for scenario_path, files in model_scenarios.items():
-            model, scenario = scenario_path.split('/')
-            
-            for file in files:
-                var = file.split('_')[-1].replace('.nc', '')
-                file_path = os.path.join(INPUT_DIR, model, scenario, file)
-                
-                metadata = process_file(file_path)
-                
-                # Update dataframes
-                for key in CSV_KEYS:
-                    if key in metadata:
-                        dfs[key].loc[var, f"{model}/{scenario}"] = metadata[key]
-                
-                pbar.update(1)
+    # Only new or changed files are probed again, the rest come from the previous audit
+    results, deleted = cached_scan_files([file_path for _, _, _, file_path in entries], process_file, error_metadata,
+                                         os.path.join(OUTPUT_DIR, "scan_cache.json"), probe_key=PROBE_KEY,
+                                         rescan=args.rescan, workers=args.workers, use_processes=not args.threads,
+                                         timeout=args.timeout, desc="Processing files")
     
-    # Save results
-    for key, df in dfs.items():
-        df.to_csv(os.path.join(OUTPUT_DIR, f"{key}.csv"))
+    # One long-format table shared with the time conversion, merged by file so the conversion's validation
+    # fields are kept. The per-key CSVs are wide views of it, written with the index under the store's lock.
+    store = records_to_frame(entries, results)
+    with store_lock(STORE_PATH):
+        merged = merge_store(store, STORE_PATH, removed=deleted)
+        write_wide_csvs(merged, CSV_KEYS, OUTPUT_DIR, variables)
+
+        # Keep the queryable index in step with the scan
+        has_time = store.get('Exists', pd.Series(index=store.index, dtype=object)).eq(TIME_PRESENT)
+        db_records = store.rename(columns=DB_COLUMNS).assign(has_time=has_time)
+        upsert_records(db_records.to_dict('records'), source='outputs')
+        remove_files(deleted)
     
     print("Date range extraction complete.")
     
-# Check for unique combinations  
-df1 = pd.read_csv(os.path.join(OUTPUT_DIR,"Calendar.csv"), index_col=0)
-df2 = pd.read_csv(os.path.join(OUTPUT_DIR,"Units.csv"), index_col=0)
-df3 = pd.read_csv(os.path.join(OUTPUT_DIR,"Num_Timesteps.csv"), index_col=0)
-df4 = pd.read_csv(os.path.join(OUTPUT_DIR,"date_range.csv"), index_col=0)
-
-# Convert DataFrames to xarray DataArrays
-da1 = xr.DataArray(df1, dims=["var", "scenario"])
-da2 = xr.DataArray(df2, dims=["var", "scenario"])
-da3 = xr.DataArray(df3, dims=["var", "scenario"])
-da4 = xr.DataArray(df4, dims=["var", "scenario"])
-
-# Combine into a Dataset with a new dimension
-ds = xr.concat([da1, da2, da3, da4], dim="source")
-ds["source"] = ["Calendar", "Units", "Timesteps", "Date Range"]
-
-# Step 1: Get the "Date Range" layer
-date_range = ds.sel(source="Date Range")
-
-# Step 2: Create a mask for entries containing 'error' or 'ymd'
-# Update the error pattern match to include new error types
-mask = date_range.astype(str).str.lower().str.contains(
-    r"error|invalid|ymd|failed|zero", 
-    regex=True
-)
-
-# Step 3: Apply the mask to extract matching entries
-error_date_ranges = date_range.where(mask)
-
-# Step 4: Extract the corresponding Calendar and Unit values
-calendars = ds.sel(source="Calendar").where(mask)
-units = ds.sel(source="Units").where(mask)
-
-# Step 5: Stack into a tidy DataFrame and drop rows with any NaNs
-error_df = xr.Dataset({
-    "date_range": error_date_ranges,
-    "calendar": calendars,
-    "unit": units
-}).stack(entry=["var", "scenario"]).to_dataframe().dropna()
-
-# Step 6: Drop duplicates of the same error/calendar/unit/var/scenario combo
-error_df = error_df.drop_duplicates(subset=["date_range", "calendar", "unit", "var", "scenario"])
+# Group the files whose date range could not be worked out by error message
+store = read_store(STORE_PATH)
+
+# Entries containing an error, 'ymd' or similar
+mask = store['date_range'].astype(str).str.lower().str.contains(r"error|invalid|ymd|failed|zero", regex=True)
 
-# Step 7: Group by the unique error messages
-grouped = error_df.groupby("date_range")
+error_df = store.loc[mask, ['date_range', 'Calendar', 'Units', 'variable']].assign(
+    scenario=store['model'] + '/' + store['scenario']
+).rename(columns={'Calendar': 'calendar', 'Units': 'unit', 'variable': 'var'})
+
+# Drop duplicates of the same error/calendar/unit/var/scenario combo
+error_df = error_df.drop_duplicates(subset=["date_range", "calendar", "unit", "var", "scenario"])
 
 # Display
-for error_msg, group in grouped:
+for error_msg, group in error_df.groupby("date_range"):
     print(f"\n{error_msg}")
-    print(group[["var", "scenario", "calendar", "unit"]])
\ No newline at end of file
+    print(group[["var", "scenario", "calendar", "unit"]])
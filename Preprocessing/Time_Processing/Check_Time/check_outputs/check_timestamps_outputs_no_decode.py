@@ -1,3 +1,4 @@
+import argparse
 import os
 import pandas as pd
 import xarray as xr
@@ -7,15 +8,26 @@ import sys
 # Add the directory of the classes
 sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
 import paths
+from File_Index import build_file_index, report_duplicates, files_by_model_scenario
+from Metadata_DB import upsert_records, remove_files
+from Metadata_Store import TIME_PRESENT, TIME_MISSING, records_to_frame, write_store, read_store, write_wide_csvs
+from Time_Scan import run_probes, cached_scan_files
 
 INPUT_DIR = "/Net/Groups/BGI/data/DataStructureMDI/DATA/Incoming/trendy/gcb2024/LAND/OUTPUT"
 OUTPUT_DIR = os.path.join(paths.CSV, "CLUSTER")
+STORE_PATH = os.path.join(OUTPUT_DIR, "time_metadata.parquet") # Long-format table the CSVs are derived from
 SCENARIOS = ['S0', 'S1', 'S2', 'S3']
 
 print(INPUT_DIR)
 
 CSV_KEYS = ['Exists', 'Units', 'Calendar', 'Num_Timesteps', 'dtype']
 
+# Store fields under their index column names
+DB_COLUMNS = {'Units': 'units', 'Calendar': 'calendar', 'Num_Timesteps': 'n_timesteps'}
+
+# Checks run against each file, all from a single open
+PROBES = ['exists', 'units_calendar', 'timesteps', 'start_step']
+
 def setup_directories():
     """Create output directory if needed"""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -34,76 +46,72 @@ def get_models_vars():
 
 def build_model_scenarios(models):
     """Create dictionary of model/scenario file listings"""
-    model_scenarios = {}
-    for model in models:
-        for scenario in SCENARIOS:
-            path = os.path.join(INPUT_DIR, model, scenario)
-            if not os.path.exists(path):
-                continue
-            
-            files = [f for f in os.listdir(path) 
-                    if f.endswith('.nc') and any(f'_{var}.nc' in f for var in variables)]
-            
-            model_scenarios[f"{model}/{scenario}"] = files
-    return model_scenarios
-
-def initialize_dataframes(variables):
-    """Create or load existing DataFrames"""
-    dfs = {}
-    for key in CSV_KEYS:
-        path = os.path.join(OUTPUT_DIR, f"{key}.csv")
-        if os.path.exists(path):
-            dfs[key] = pd.read_csv(path, index_col=0)
-        else:
-            dfs[key] = pd.DataFrame(index=variables)
-    return dfs
+    # One walk of INPUT_DIR shared with the conversion script, ambiguous matches are reported
+    index, duplicates = build_file_index(INPUT_DIR, models=models, scenarios=SCENARIOS, variables=variables)
+    report_duplicates(duplicates)
+    return files_by_model_scenario(index)
 
 def process_file(file_path):
     """Extract metadata from a NetCDF file"""
-    try:
-        with xr.open_dataset(file_path, decode_times=False) as ds:
-            if 'time' not in ds:
-                return {'Exists': 'Missing'}
-            
-            time_var = ds.time
-            return {
-                'Exists': 'Present',
-                'Units': str(time_var.units),
-                'Calendar': str(time_var.calendar),
-                'Num_Timesteps': len(time_var),
-                'dtype': str(time_var.dtype)
-            }
-            
-    except Exception as e:
-        return {'Exists': f"Error: {str(e)}"}
+    # Header-only read of the time variable, no xarray dataset is built
+    header = run_probes(file_path, PROBES)
+
+    if header['error'] is not None:
+        return {'Exists': f"Error: {header['error']}"}
+
+    if not header['has_time']:
+        return {'Exists': TIME_MISSING}
+
+    return {
+        'Exists': TIME_PRESENT,
+        'Units': str(header['units']),
+        'Calendar': str(header['calendar']),
+        'Num_Timesteps': header['n_timesteps'],
+        'dtype': header['dtype'],
+        'start_date': header.get('start_date'),
+        'step_days': header.get('step_days')
+    }
+
+def error_metadata(file_path, message):
+    """Record for a file whose probe failed or timed out"""
+    return {'Exists': f"Error: {message}"}
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract the time metadata of every TRENDY output file')
+    parser.add_argument('--workers', type=int, default=1, help='Number of files probed at once')
+    parser.add_argument('--threads', action='store_true', help='Use threads instead of processes, only safe with a thread-safe netCDF-C build')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds before a hung file is recorded as an error')
+    parser.add_argument('--rescan', action='store_true', help='Ignore the scan cache and probe every file again')
+    args = parser.parse_args()
+
     print("Starting metadata extraction...")
     setup_directories()
     models, variables = get_models_vars()
     model_scenarios = build_model_scenarios(models)
-    dfs = initialize_dataframes(variables)
     
-    total_files = sum(len(files) for files in model_scenarios.values())
+    # Flatten into one ordered list so results map back to the same cells whatever order they finish in
+    entries = []
+    for scenario_path, files in model_scenarios.items():
+        model, scenario = scenario_path.split('/')
+        for file in files:
+            var = file.split('_')[-1].replace('.nc', '')
+            entries.append((model, scenario, var, os.path.join(INPUT_DIR, model, scenario, file)))
+    
+    # Only new or changed files are probed again, the rest come from the previous audit
+    results, deleted = cached_scan_files([file_path for _, _, _, file_path in entries], process_file, error_metadata,
+                                         os.path.join(OUTPUT_DIR, "scan_cache.json"), probe_key=",".join(PROBES),
+                                         rescan=args.rescan, workers=args.workers, use_processes=not args.threads,
+                                         timeout=args.timeout, desc="Processing files")
     
-    with tqdm(total=total_files, desc="Processing files") as pbar:
-        for scenario_path, files in model_scenarios.items():
-            model, scenario = scenario_path.split('/')
-            
-            for file in files:
-                var = file.split('_')[-1].replace('.nc', '')
-                file_path = os.path.join(INPUT_DIR, model, scenario, file)
-                
-                metadata = process_file(file_path)
-                
-                for key in CSV_KEYS:
-                    if key in metadata:
-                        dfs[key].loc[var, f"{model}/{scenario}"] = metadata[key]
-                
-                pbar.update(1)
+    # One long-format table, the per-key CSVs are wide views of it
+    store = records_to_frame(entries, results)
+    write_store(store, STORE_PATH)
+    write_wide_csvs(store, CSV_KEYS, OUTPUT_DIR, variables)
     
-    # Save results
-    for key, df in dfs.items():
-        df.to_csv(os.path.join(OUTPUT_DIR, f"{key}.csv"))
+    # Keep the queryable index in step with the scan
+    has_time = store.get('Exists', pd.Series(index=store.index, dtype=object)).eq(TIME_PRESENT)
+    db_records = store.rename(columns=DB_COLUMNS).assign(has_time=has_time)
+    upsert_records(db_records.to_dict('records'), source='outputs')
+    remove_files(deleted)
     
     print("Metadata extraction complete.")
\ No newline at end of file
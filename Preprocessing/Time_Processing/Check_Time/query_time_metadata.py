@@ -0,0 +1,45 @@
+# Run it in bash like this: python query_time_metadata.py files --calendar 365_day --frequency monthly --start-year 1701
+# or: python query_time_metadata.py combos --source inputs
+# Queries the SQLite index the check_timestamps scripts populate, nothing is rescanned or reread from the CSVs.
+
+import argparse
+import os
+import sys
+import pandas as pd
+
+# Add the directory of the classes
+sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
+from Metadata_DB import DB_PATH, COMBO_COLUMNS, query_files, example_per_combo
+
+# CLI flag -> column, each flag can be given several values
+FILTERS = ['source', 'model', 'scenario', 'variable', 'calendar', 'units', 'dtype', 'n_timesteps', 'start_year', 'frequency']
+INT_FILTERS = ['n_timesteps', 'start_year']
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the TRENDY file metadata index')
+    parser.add_argument('command', choices=['files', 'combos'], help='files: matching files, combos: one example file per distinct combination')
+    for name in FILTERS:
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, nargs='+', type=int if name in INT_FILTERS else str)
+    parser.add_argument('--columns', nargs='+', default=None, help='Columns to show (files) or group by (combos)')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--csv', default=None, help='Also write the result to this CSV')
+    args = parser.parse_args()
+
+    filters = {name: getattr(args, name) for name in FILTERS if getattr(args, name) is not None}
+
+    if args.command == 'files':
+        df = query_files(args.columns or ['model', 'scenario', 'variable', 'calendar', 'frequency', 'start_date', 'n_timesteps', 'file_path'],
+                         limit=args.limit, db_path=args.db, **filters)
+    else:
+        df = example_per_combo(args.columns or COMBO_COLUMNS, db_path=args.db, **filters)
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+        print(df.to_string(index=False))
+    print(f"{len(df)} rows")
+
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -1,189 +1,445 @@
 # Run it in bash like this: python cdo_time_conversion.py --model CABLE-POP
-# It takes a model directory as an argument
+# It takes one or more model directories as arguments, or --all for every model in the timesteps CSV
+# Add --engine xarray to rewrite only the time axis in a single write instead of the four-step cdo chain
+# Add --jobs N to convert up to N files at once
+# --shard FILE runs only the tasks in a shard list written by plan_slurm_shards.py
+# Every finished output is validated from its header and recorded in the same store the output checkers use
 
 import argparse
 import os
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import tempfile
+import numpy as np
 import pandas as pd
+import xarray as xr
 from tqdm import tqdm
 import shutil
+import sys
 
-# Settings
-replace_files = False # This decides whether or not existing files should be overwritten
+# Add the directory of the classes
+sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
+import paths
+from File_Index import build_file_index, report_duplicates
+from Manifest import MANIFEST_PATH, load_manifest, update_manifest, build_record, needs_rebuild, record_output
+from Metadata_DB import upsert_records
+from Metadata_Store import TIME_PRESENT, TIME_MISSING, records_to_frame, store_lock, merge_store, write_wide_csvs
+from Time_Scan import run_probes
 
-# Initialize argument parser
-parser = argparse.ArgumentParser(description='Standardise Timestamps of TRENDY data')
-parser.add_argument('--model', required=True, help='Model name to process (e.g., "CESM2")')
-args = parser.parse_args()
+# Settings
+replace_files = False # This decides whether or not up-to-date files should be overwritten anyway
+tool_version = "2" # Bump when the conversion itself changes so every output is rebuilt
 
 # Read both CSVs
 csv_path = "/Net/Groups/BSI/work_scratch/ecathain/mpi2/Outputs/CSVs/Timesteps/Outputs/Num_Timesteps.csv"
 data_path = "/Net/Groups/BSI/work_scratch/ecathain/mpi2/TRENDY/Raw/OUTPUT"
 output_path = "/Net/Groups/BSI/work_scratch/ecathain/mpi2/TRENDY/Standard_Time/OUTPUT"
+manifest_path = MANIFEST_PATH # Records how each output was built, kept next to output_path
+metadata_store = paths.TIME_METADATA_STORE # Same store check_timestamps_outputs_decode.py writes
+metadata_dir = os.path.dirname(metadata_store) # Its wide CSVs are rewritten here
+metadata_db = paths.METADATA_DB
+validation_batch = 20 # Outputs whose validation records and manifest entries are saved together
+
+# Define valid timestep mappings
+timestep_map = {
+    "3888.0": ("1700-01-01", "1mon"),
+    "324.0":  ("1700-01-01", "365day"),
+    "3876.0": ("1701-01-01", "1mon"),
+    "323.0":  ("1701-01-01", "365day"),
+    "1968.0": ("1860-01-01", "1mon"),
+    "164.0":  ("1860-01-01", "365day"),
+    "1488.0": ("1900-01-01", "1mon"),
+    "1" : ("1700-01-01", "1day")
+}
+
+# Timesteps where all values are identical and only the first one is kept
+short_timesteps = ["10.0"]
+
+# The window every standardised file is cut down to
+select_start_year = 1900
+select_end_year = 2023
+
+# Day of the year each month starts on in the 365_day calendar
+month_start_days = np.cumsum([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30])[:12]
+
+def run_cdo(cmd, log):
+    # Capture the output so it can be reported with the task instead of interleaving between workers
+    log.append(f"Running: {' '.join(cmd)}")
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    for stream in (result.stdout, result.stderr):
+        if stream and stream.strip():
+            log.append(stream.strip())
+
+def convert_short_cdo(matched_file, new_path, log):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        temp1 = os.path.join(tmpdir, "step1.nc")
+        temp2 = os.path.join(tmpdir, "step2.nc")
+        temp3 = os.path.join(tmpdir, "step3.nc")
+
+        # 1. Select only the first timestep
+        run_cdo(["cdo", "seltimestep,1", matched_file, temp1], log)
+
+        # 2. Set calendar to 365_day
+        run_cdo(["cdo", "-setcalendar,standard", temp1, temp2], log)
+
+        # 3. Set reference time (time unit: days since ...)
+        run_cdo(["cdo", f"-settaxis,1700-01-01,00:00:00,365day", temp2, temp3], log)
+
+        # 4. Move to final path
+        shutil.move(temp3, new_path)
+
+def convert_cdo(matched_file, new_path, start_date, interval, log):
+    start_time = "00:00:00"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        temp1 = os.path.join(tmpdir, "step1.nc")
+        temp2 = os.path.join(tmpdir, "step2.nc")
+        temp3 = os.path.join(tmpdir, "step3.nc")
+
+        # 1. Set calendar first
+        run_cdo(["cdo", "-setcalendar,365_day", matched_file, temp1], log)
+
+        # 2. Set time axis
+        run_cdo(["cdo", f"-settaxis,{start_date},{start_time},{interval}", temp1, temp2], log)
+
+        # 3. Set reference time last
+        run_cdo(["cdo", f"-setreftime,{start_date},{start_time}", temp2, temp3], log)
+
+        # 4. Trim the time to 1900-2023
+        run_cdo(["cdo", f"-seldate,{select_start_year}-01-01,{select_end_year}-12-31", temp3, new_path], log)
+
+def taxis_days(interval, n_steps):
+    # Offsets in days from the start date, matching cdo settaxis on a 365_day calendar (start dates are all 01-01)
+    steps = np.arange(n_steps)
+    if interval == "1mon":
+        return (steps // 12) * 365 + month_start_days[steps % 12]
+    if interval == "365day":
+        return steps * 365
+    if interval == "1day":
+        return steps
+    raise ValueError(f"Unsupported interval: {interval}")
+
+def convert_xarray(matched_file, new_path, timestep):
+    # Rewrite only the time coordinate and write the 1900-2023 slice in one pass. There is no dask here, so to_netcdf
+    # reads each variable's trimmed slice into memory in full (one variable at a time) before writing it.
+    with xr.open_dataset(matched_file, decode_times=False) as ds:
+        if timestep in short_timesteps:
+            # Same result as the short cdo path: first timestep on a standard calendar from 1700-01-01
+            start_date, calendar = "1700-01-01", "standard"
+            ds = ds.isel(time=slice(0, 1))
+            days = taxis_days("365day", 1)
+        else:
+            start_date, interval = timestep_map[timestep]
+            calendar = "365_day"
+            days = taxis_days(interval, ds.sizes["time"])
+
+            # Equivalent of seldate: keep the contiguous block of timesteps that falls in the window
+            years = int(start_date[:4]) + days // 365
+            keep = np.flatnonzero((years >= select_start_year) & (years <= select_end_year))
+            if keep.size == 0:
+                raise ValueError(f"No timesteps between {select_start_year} and {select_end_year}")
+            ds = ds.isel(time=slice(keep[0], keep[-1] + 1))
+            days = days[keep[0]:keep[-1] + 1]
+
+        # Bounds from the raw file no longer match the new axis
+        bounds = ds["time"].attrs.get("bounds")
+        if bounds in ds.variables:
+            ds = ds.drop_vars(bounds)
+
+        time = xr.Variable("time", days.astype("float64"), {
+            "standard_name": "time",
+            "units": f"days since {start_date} 00:00:00",
+            "calendar": calendar,
+            "axis": "T",
+        })
+        ds = ds.assign_coords(time=time)
+        ds["time"].encoding = {"dtype": "float64"}
+
+        ds.to_netcdf(new_path)
+
+def process_file(matched_file, new_path, timestep, engine, log):
+    if engine == "xarray":
+        convert_xarray(matched_file, new_path, timestep)
+    elif timestep in short_timesteps:
+        convert_short_cdo(matched_file, new_path, log)
+    else:
+        start_date, interval = timestep_map[timestep]
+        convert_cdo(matched_file, new_path, start_date, interval, log)
+
+def expected_timesteps(timestep):
+    # Length every output should have once cut down to the select_start_year-select_end_year window
+    if timestep in short_timesteps:
+        return 1
+    interval = timestep_map[timestep][1]
+    n_years = select_end_year - select_start_year + 1
+    if interval == "1mon":
+        return n_years * 12
+    if interval == "365day":
+        return n_years
+    return int(float(timestep))
+
+def validation_record(new_path, timestep):
+    # Same fields as check_timestamps_outputs_no_decode.py, read from the header of the file just written
+    header = run_probes(new_path, ['exists', 'units_calendar', 'timesteps', 'start_step'])
+    expected = expected_timesteps(timestep)
+    expected_calendar = "standard" if timestep in short_timesteps else "365_day"
+
+    if header['error'] is not None or not header.get('has_time'):
+        return {'Exists': f"Error: {header['error']}" if header['error'] else TIME_MISSING,
+                'Expected_Timesteps': expected, 'Validation': 'No time axis'}
+
+    units = str(header['units'])
+    problems = []
+    if header['n_timesteps'] != expected:
+        problems.append(f"length {header['n_timesteps']} != {expected}")
+    if str(header['calendar']) != expected_calendar:
+        problems.append(f"calendar {header['calendar']} != {expected_calendar}")
+
+    return {
+        'Exists': TIME_PRESENT,
+        'Units': units,
+        'Calendar': str(header['calendar']),
+        'Num_Timesteps': header['n_timesteps'],
+        'dtype': header['dtype'],
+        'start_date': header.get('start_date'),
+        'step_days': header.get('step_days'),
+        'Expected_Timesteps': expected,
+        'Reference_Time': units.split('since')[-1].strip() if 'since' in units else None,
+        'Validation': "; ".join(problems) if problems else "OK"
+    }
+
+def run_task(task, engine):
+    # Runs in a worker process, everything printed is returned in the log
+    log = []
+    matched_file, new_path, timestep = task["matched_file"], task["new_path"], task["timestep"]
+
+    # Write to a partial file and rename on completion so a crash never leaves a truncated output behind
+    part_path = f"{new_path}.part"
+
+    try:
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        process_file(matched_file, part_path, timestep, engine, log)
+        os.replace(part_path, new_path)
+
+        # The record the output audit would produce, so no separate re-read of every file is needed
+        task["validation"] = validation_record(new_path, timestep)
+        if task["validation"]["Validation"] != "OK":
+            # Not recorded in the manifest, so the next run rebuilds it
+            log.append(f"Validation failed for {new_path}: {task['validation']['Validation']}")
+            return task, False, log
+
+        if timestep in short_timesteps:
+            log.append(f"Successfully processed (short time trimmed): {new_path}")
+        else:
+            log.append(f"Successfully processed: {new_path}")
+        return task, True, log
+
+    except subprocess.CalledProcessError as e:
+        log.append(f"\nFailed processing {matched_file}:")
+        log.append(f"Error: {e.stderr or 'No stderr captured'}")
+        log.append(f"Output: {e.stdout or 'No stdout captured'}")
 
-# Read in the Timesteps DF
-df = pd.read_csv(os.path.join(csv_path), index_col=0)
-df = df.astype(str)
+    except Exception as e:
+        # netCDF4/xarray raise RuntimeError, KeyError, ... on corrupt or unusual files, one bad file must not stop the run
+        log.append(f"\nFailed processing {matched_file}:")
+        log.append(f"Error: {type(e).__name__}: {e}")
 
-# Filter columns for the specified model
-model_columns = [col for col in df.columns if col.startswith(f"{args.model}/")]
+    if os.path.exists(part_path):
+        os.remove(part_path)
 
-if not model_columns:
-    raise ValueError(f"No scenarios found for model: {args.model}")
+    return task, False, log
 
-# Calculate total tasks for progress bar
-total_variables = len(df.index)
-total_scenarios = len(model_columns)
-total_tasks = total_variables * total_scenarios
+def read_shard(path):
+    # One "model<TAB>scenario<TAB>variable<TAB>bytes" line per task
+    with open(path) as f:
+        return [tuple(line.rstrip("\n").split("\t")[:3]) for line in f if line.strip()]
+
+def write_shard(path, tasks):
+    with open(path, "w") as f:
+        for task in tasks:
+            f.write(f"{task['model']}\t{task['scenario']}\t{task['variable']}\t{task['bytes']}\n")
+
+def plan_tasks(df, model, file_index, manifest, engine, pbar, only=None, verbose=True):
+    # Match every variable/scenario of a model to its raw file, skipped entries are ticked off the progress bar
+    # only restricts planning to a set of (model, scenario, variable) keys
+    # Nothing is written here, output directories are created when a task runs
+    tasks = []
+
+    # Filter columns for the specified model
+    model_columns = [col for col in df.columns if col.startswith(f"{model}/")]
+
+    if not model_columns:
+        raise ValueError(f"No scenarios found for model: {model}")
 
-# --- Modified processing loop ---
-with tqdm(total=total_tasks, desc=f"Processing {args.model}", unit="task") as pbar:
     for col in model_columns:
         model, scenario = col.split("/")
-        
+
         for var in df.index:
-            pbar.update(1)
-            
-            if pd.isna(df.loc[var, col]):
+            if only is not None and (model, scenario, var) not in only:
                 continue
 
-            subdir = os.path.join(data_path, model, scenario)
-            
-            if not os.path.isdir(subdir):
-                tqdm.write(f"Directory not found: {subdir}")
+            if pd.isna(df.loc[var, col]):
+                pbar.update(1)
                 continue
 
-            matched_file = None
-            target_suffix = f"_{var}.nc"  # Correct variable suffix
-            for f in os.listdir(subdir):
-                if f.endswith(target_suffix):
-                    matched_file = os.path.join(subdir, f)
-                    break
+            matched_file = file_index.get((model, scenario, var))
 
             if not matched_file:
                 tqdm.write(f"No file match for {model}/{scenario} and variable {var}")
+                pbar.update(1)
                 continue
-            
+
             # Path setup and existence check
             relative_path = os.path.relpath(matched_file, data_path)
             new_path = os.path.join(output_path, relative_path)
-            os.makedirs(os.path.dirname(new_path), exist_ok=True)
-
-            # Move this up here so it applies before anything happens
-            if not replace_files and os.path.isfile(new_path):
-                tqdm.write(f"Skipping existing file: {new_path}")
-                continue  # Skip to next variable
-
-            # Define valid timestep mappings
-            timestep_map = {
-                "3888.0": ("1700-01-01", "1mon"),
-                "324.0":  ("1700-01-01", "365day"),
-                "3876.0": ("1701-01-01", "1mon"),
-                "323.0":  ("1701-01-01", "365day"),
-                "1968.0": ("1860-01-01", "1mon"),
-                "164.0":  ("1860-01-01", "365day"),
-                "1488.0": ("1900-01-01", "1mon"),
-                "1" : ("1700-01-01", "1day")
-            }
 
             timestep = df.loc[var, col]
 
-            # Special-case short timestep handling
-            if timestep in ["10.0"]:
-                try:
-                    with tempfile.TemporaryDirectory() as tmpdir:
-                        temp1 = os.path.join(tmpdir, "step1.nc")
-                        temp2 = os.path.join(tmpdir, "step2.nc")
-                        temp3 = os.path.join(tmpdir, "step3.nc")
-
-                        # 1. Select only the first timestep
-                        cmd1 = ["cdo", "seltimestep,1", matched_file, temp1]
-                        tqdm.write(f"Running: {' '.join(cmd1)}")
-                        subprocess.run(cmd1, check=True)
-
-                        # 2. Set calendar to 365_day
-                        cmd2 = ["cdo", "-setcalendar,standard", temp1, temp2]
-                        tqdm.write(f"Running: {' '.join(cmd2)}")
-                        subprocess.run(cmd2, check=True)
-
-                        # 3. Set reference time (time unit: days since ...)
-                        cmd3 = ["cdo", f"-settaxis,1700-01-01,00:00:00,365day", temp2, temp3]
-                        tqdm.write(f"Running: {' '.join(cmd3)}")
-                        subprocess.run(cmd3, check=True)
-
-                        # 4. Move to final path
-                        shutil.move(temp3, new_path)
-
-                    tqdm.write(f"Successfully processed (short time trimmed): {new_path}")
-
-                except subprocess.CalledProcessError as e:
-                    tqdm.write(f"\nFailed processing {matched_file}:")
-                    tqdm.write(f"Error: {e.stderr or 'No stderr captured'}")
-                    tqdm.write(f"Output: {e.stdout or 'No stdout captured'}")
-
-                continue  # Skip rest of loop for these cases
-            
             # Catch unknown cases
-            if timestep not in timestep_map:
+            if timestep not in timestep_map and timestep not in short_timesteps:
                 tqdm.write(f"Unknown timestep amount for {model}/{scenario} and variable {var}")
+                pbar.update(1)
                 continue
 
-            # Use the known values
-            start_date, interval = timestep_map[timestep]
-            start_time = "00:00:00"
-
-            try:
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    temp1 = os.path.join(tmpdir, "step1.nc")
-                    temp2 = os.path.join(tmpdir, "step2.nc")
-                    temp3 = os.path.join(tmpdir, "step3.nc")
-
-                    # 1. Set calendar first
-                    cmd1 = [
-                        "cdo",
-                        "-setcalendar,365_day",
-                        matched_file,
-                        temp1
-                    ]
-                    tqdm.write(f"Running: {' '.join(cmd1)}") 
-                    subprocess.run(cmd1, check=True)
-
-                    # 2. Set time axis
-                    cmd2 = [
-                        "cdo",
-                        f"-settaxis,{start_date},{start_time},{interval}",
-                        temp1,
-                        temp2
-                    ]
-                    tqdm.write(f"Running: {' '.join(cmd2)}") 
-                    subprocess.run(cmd2, check=True)
-
-                    # 3. Set reference time last
-                    cmd3 = [
-                        "cdo",
-                        f"-setreftime,{start_date},{start_time}",
-                        temp2,
-                        temp3
-                    ]
-                    tqdm.write(f"Running: {' '.join(cmd3)}") 
-                    subprocess.run(cmd3, check=True)
-                    
-                    # 4. Trim the time to 1900-2023
-                    cmd4 = [
-                        "cdo",
-                        "-seldate,1900-01-01,2023-12-31",
-                        temp3,
-                        new_path
-                    ]
-                    tqdm.write(f"Running: {' '.join(cmd4)}") 
-                    subprocess.run(cmd4, check=True)
-                    
-                tqdm.write(f"Successfully processed: {new_path}")
-
-            except subprocess.CalledProcessError as e:
-                tqdm.write(f"\nFailed processing {matched_file}:")
-                tqdm.write(f"Error: {e.stderr or 'No stderr captured'}")
-                tqdm.write(f"Output: {e.stdout or 'No stdout captured'}")
-                
-                
+            # Only rebuild outputs that are missing, truncated or older than their inputs
+            mapping = timestep_map.get(timestep)
+            record = build_record(matched_file, timestep=timestep,
+                                  timestep_map=list(mapping) if mapping else None,
+                                  tool_version=f"{engine}-{tool_version}")
+
+            if not replace_files and not needs_rebuild(manifest, relative_path, new_path, record):
+                if verbose:
+                    tqdm.write(f"Skipping up-to-date file: {new_path}")
+                pbar.update(1)
+                continue  # Skip to next variable
+
+            tasks.append({"model": model, "scenario": scenario, "variable": var,
+                          "matched_file": matched_file, "new_path": new_path, "timestep": timestep,
+                          "relative_path": relative_path, "record": record})
+
+    return tasks
+
+def store_validation(tasks):
+    # Merge the validation records into the checkers' long-format store, its wide CSVs and the SQLite index.
+    # All three are written under the store's lock: array tasks finish at the same time and SQLite's own
+    # locking is not reliable on NFS.
+    done = [task for task in tasks if "validation" in task]
+    if not done:
+        return
+
+    store = records_to_frame([(t["model"], t["scenario"], t["variable"], t["new_path"]) for t in done],
+                             [t["validation"] for t in done])
+    with store_lock(metadata_store):
+        store = merge_store(store, metadata_store)
+        write_wide_csvs(store, ['Exists', 'Units', 'Calendar', 'Num_Timesteps', 'dtype', 'Expected_Timesteps', 'Validation'], metadata_dir)
+
+        upsert_records([dict(t["validation"], model=t["model"], scenario=t["scenario"], variable=t["variable"],
+                             file_path=t["new_path"], units=t["validation"].get('Units'),
+                             calendar=t["validation"].get('Calendar'), n_timesteps=t["validation"].get('Num_Timesteps'),
+                             has_time=t["validation"]['Exists'] == TIME_PRESENT)
+                        for t in done], source='outputs', db_path=metadata_db)
+
+def run_tasks(tasks, engine, jobs, manifest, manifest_path, pbar):
+    # Run the conversions with at most `jobs` at once, reporting each task's log as it completes
+    failures = []
+    batch = []
+
+    def flush():
+        # The manifest is updated first, so a problem with the metadata store never costs the record of
+        # outputs that converted fine
+        entries = {t["relative_path"]: record_output(manifest, t["relative_path"], t["new_path"], t["record"])
+                   for t in batch if t["ok"]}
+        if entries:
+            update_manifest(entries, manifest_path)
+        try:
+            store_validation(batch)
+        finally:
+            batch.clear()
+
+    def report(task, ok, log):
+        for line in log:
+            tqdm.write(line)
+        if not ok:
+            failures.append(task)
+        # Failed validations are stored too, they just never reach the manifest
+        if ok or "validation" in task:
+            batch.append(dict(task, ok=ok))
+        if len(batch) >= validation_batch:
+            flush()
+        pbar.update(1)
+
+    try:
+        run_all(tasks, engine, jobs, report)
+    finally:
+        # Also on Ctrl-C or a crash, everything that finished is kept
+        flush()
+    return failures
+
+def run_all(tasks, engine, jobs, report):
+    # Serially or on a process pool, report(task, ok, log) is always called in this process
+    if jobs <= 1:
+        for task in tasks:
+            report(*run_task(task, engine))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(run_task, task, engine): task for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    report(*future.result())
+                except Exception as e:
+                    # The worker itself died (e.g. killed for memory), so clean up its partial file here
+                    task = futures[future]
+                    part_path = f"{task['new_path']}.part"
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    report(task, False, [f"\nFailed processing {task['matched_file']}:", f"Error: {type(e).__name__}: {e}"])
+
+def main():
+    # Initialize argument parser
+    parser = argparse.ArgumentParser(description='Standardise Timestamps of TRENDY data')
+    models_group = parser.add_mutually_exclusive_group(required=True)
+    models_group.add_argument('--model', nargs='+', help='Model name(s) to process (e.g., "CESM2")')
+    models_group.add_argument('--all', action='store_true', help='Process every model in the timesteps CSV')
+    models_group.add_argument('--shard', help='Process only the tasks listed in this shard file')
+    parser.add_argument('--engine', choices=['cdo', 'xarray'], default='cdo',
+                        help='cdo runs the four-step cdo chain, xarray rewrites only the time axis in one write')
+    parser.add_argument('--jobs', type=int, default=1, help='Maximum number of files converted at once')
+    args = parser.parse_args()
+
+    # Read in the Timesteps DF
+    df = pd.read_csv(os.path.join(csv_path), index_col=0)
+    df = df.astype(str)
+
+    only = None
+    if args.shard:
+        only = set(read_shard(args.shard))
+        models = list(dict.fromkeys(model for model, _, _ in sorted(only)))
+    elif args.all:
+        models = list(dict.fromkeys(col.split("/")[0] for col in df.columns))
+    else:
+        models = args.model
+
+    # One progress tick per variable/scenario, whether it is skipped while planning or converted later
+    if only is not None:
+        total_tasks = len(only)
+    else:
+        total_tasks = sum(len(df.index) for col in df.columns if col.split("/")[0] in models)
+
+    # List the raw directory once instead of once per variable and scenario
+    file_index, duplicates = build_file_index(data_path, models=models)
+    report_duplicates(duplicates)
+
+    manifest = load_manifest(manifest_path)
+
+    with tqdm(total=total_tasks, desc=f"Processing {', '.join(models)}", unit="task") as pbar:
+        tasks = []
+        for model in models:
+            tasks.extend(plan_tasks(df, model, file_index, manifest, args.engine, pbar, only=only))
+
+        failures = run_tasks(tasks, args.engine, args.jobs, manifest, manifest_path, pbar)
+
+    if failures:
+        print(f"{len(failures)} of {len(tasks)} conversions failed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# Run it in bash like this: python plan_slurm_shards.py --shards 16 --engine xarray
+# Builds every (model, scenario, variable) conversion task from the timesteps CSV, balances them into
+# shards by input file size, writes one task list per shard plus a SLURM array script and submits it.
+# Use --dry-run to only print the shard plan, and --sbatch-cmd to point at a fake sbatch for local testing.
+
+import argparse
+import heapq
+import os
+import subprocess
+import pandas as pd
+from tqdm import tqdm
+
+# Importing the conversion script also puts the Classes directory on sys.path
+import cdo_time_conversion as conversion
+from File_Index import build_file_index, report_duplicates
+from Manifest import load_manifest
+
+# Settings
+plan_dir = "/Net/Groups/BSI/work_scratch/ecathain/mpi2/Outputs/Slurm/Time_Conversion" # Shard lists, array script and logs go here
+
+slurm_template = """#!/bin/bash
+#SBATCH --job-name=trendy_time
+#SBATCH --array=0-{last_shard}
+#SBATCH --cpus-per-task={jobs}
+#SBATCH --mem={mem}
+#SBATCH --time={time}
+#SBATCH --output={log_dir}/shard_%a.out
+{partition_line}
+# Each array task converts its own shard
+SHARD=$(printf "%03d" "$SLURM_ARRAY_TASK_ID")
+python {script} --shard {plan_dir}/shard_$SHARD.txt --engine {engine} --jobs {jobs}
+"""
+
+def collect_tasks(df, models, engine):
+    # Same planning as the conversion script, so up-to-date outputs never end up in a shard.
+    # Planning writes nothing, so this is safe for --dry-run
+    file_index, duplicates = build_file_index(conversion.data_path, models=models)
+    report_duplicates(duplicates)
+    manifest = load_manifest(conversion.manifest_path)
+
+    tasks = []
+    with tqdm(disable=True) as pbar:
+        for model in models:
+            tasks.extend(conversion.plan_tasks(df, model, file_index, manifest, engine, pbar, verbose=False))
+
+    for task in tasks:
+        task["bytes"] = os.path.getsize(task["matched_file"])
+    return tasks
+
+def balance_shards(tasks, n_shards):
+    # Largest file first onto the currently lightest shard
+    shards = [[] for _ in range(n_shards)]
+    loads = [(0, i) for i in range(n_shards)]
+    heapq.heapify(loads)
+
+    for task in sorted(tasks, key=lambda t: (-t["bytes"], t["model"], t["scenario"], t["variable"])):
+        load, i = heapq.heappop(loads)
+        shards[i].append(task)
+        heapq.heappush(loads, (load + task["bytes"], i))
+
+    return shards
+
+def print_plan(shards):
+    total = sum(t["bytes"] for shard in shards for t in shard)
+    print(f"{sum(len(s) for s in shards)} tasks, {total / 1024**3:.2f} GiB across {len(shards)} shards")
+    for i, shard in enumerate(shards):
+        shard_bytes = sum(t["bytes"] for t in shard)
+        print(f"  shard_{i:03d}: {len(shard):4d} tasks, {shard_bytes / 1024**3:8.2f} GiB")
+
+def write_plan(shards, args):
+    log_dir = os.path.join(args.plan_dir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    for i, shard in enumerate(shards):
+        conversion.write_shard(os.path.join(args.plan_dir, f"shard_{i:03d}.txt"), shard)
+
+    script_path = os.path.join(args.plan_dir, "convert_array.sbatch")
+    with open(script_path, "w") as f:
+        f.write(slurm_template.format(
+            last_shard=len(shards) - 1,
+            jobs=args.jobs,
+            mem=args.mem,
+            time=args.time,
+            log_dir=log_dir,
+            partition_line=f"#SBATCH --partition={args.partition}\n" if args.partition else "",
+            script=os.path.abspath(conversion.__file__),
+            plan_dir=args.plan_dir,
+            engine=args.engine,
+        ))
+    return script_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Plan the TRENDY time conversion as a SLURM array job')
+    parser.add_argument('--model', nargs='+', help='Model name(s) to plan, defaults to every model in the timesteps CSV')
+    parser.add_argument('--shards', type=int, required=True, help='Number of array tasks')
+    parser.add_argument('--engine', choices=['cdo', 'xarray'], default='cdo')
+    parser.add_argument('--jobs', type=int, default=1, help='--jobs passed to each array task')
+    parser.add_argument('--mem', default='16G')
+    parser.add_argument('--time', default='04:00:00')
+    parser.add_argument('--partition', default=None)
+    parser.add_argument('--plan-dir', default=plan_dir)
+    parser.add_argument('--sbatch-cmd', default='sbatch', help='Command used to submit the array script')
+    parser.add_argument('--dry-run', action='store_true', help='Print the shard plan and estimated bytes, write and submit nothing')
+    parser.add_argument('--no-submit', action='store_true', help='Write the shard lists and script without submitting')
+    args = parser.parse_args()
+
+    # Read in the Timesteps DF
+    df = pd.read_csv(conversion.csv_path, index_col=0)
+    df = df.astype(str)
+
+    models = args.model or list(dict.fromkeys(col.split("/")[0] for col in df.columns))
+
+    tasks = collect_tasks(df, models, args.engine)
+    if not tasks:
+        print("Nothing to convert, every output is up to date")
+        return
+
+    # Never more shards than tasks
+    shards = balance_shards(tasks, min(args.shards, len(tasks)))
+    print_plan(shards)
+
+    if args.dry_run:
+        return
+
+    script_path = write_plan(shards, args)
+    print(f"Wrote {len(shards)} shard lists and {script_path}")
+
+    if not args.no_submit:
+        result = subprocess.run([*args.sbatch_cmd.split(), script_path], check=True, capture_output=True, text=True)
+        print(result.stdout.strip())
+
+if __name__ == "__main__":
+    main()
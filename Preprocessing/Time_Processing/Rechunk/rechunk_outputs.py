@@ -0,0 +1,239 @@
+# Run it in bash like this: python rechunk_outputs.py --all --jobs 4
+# Optional stage after the time standardisation. Rewrites each standardised file so every variable is stored in
+# time-contiguous spatial tiles (one chunk holds the full time series of a tile_lat x tile_lon block) with
+# configurable zlib/shuffle compression. Per-pixel time series reads (Time.extract_np_array, training loaders)
+# then touch one chunk instead of one chunk per timestep.
+# A read-speed report (point and window access, before vs after) is written next to the outputs.
+# With --in-place the conversion manifest is updated as well, so the time conversion does not rebuild the rewritten files.
+# The whole variable is loaded for the rewrite, so give each job enough memory for the largest file uncompressed.
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import xarray as xr
+import netCDF4
+from tqdm import tqdm
+import sys
+
+# Add the directory of the classes
+sys.path.append(os.path.abspath("/Net/Groups/BSI/work_scratch/ecathain/mpi2/Finished_Scripts/Classes"))
+import paths
+from Manifest import MANIFEST_PATH, load_manifest, update_manifest, build_record, needs_rebuild, record_output, refresh_output_stamp
+
+# Settings
+input_path = paths.STD_TIME_OUTPUT
+output_path = f"{paths.STD_TIME}/OUTPUT_Rechunked" # Use --in-place to replace the files in input_path instead
+report_path = os.path.join(paths.CSV, "Rechunk", "read_speed_report.csv")
+conversion_manifest = MANIFEST_PATH # Written by cdo_time_conversion.py, keyed by the same relative paths
+tool_version = "1" # Bump when the rewrite itself changes so every output is rebuilt
+
+# Read benchmark
+n_points = 50 # Random pixels read as full time series
+window_size = 10 # Side of the square lat/lon window read as full time series
+n_windows = 5
+seed = 0
+
+def chunk_encoding(ds, tile_lat, tile_lon, complevel, shuffle):
+    # Full time axis per chunk, spatial tiles, any other dimension (e.g. PFT) one level per chunk
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        if not {"time", "lat", "lon"} <= set(var.dims):
+            continue
+        chunks = []
+        for dim in var.dims:
+            if dim == "time":
+                chunks.append(var.sizes[dim])
+            elif dim == "lat":
+                chunks.append(min(tile_lat, var.sizes[dim]))
+            elif dim == "lon":
+                chunks.append(min(tile_lon, var.sizes[dim]))
+            else:
+                chunks.append(1)
+        encoding[name] = {"zlib": complevel > 0, "complevel": complevel, "shuffle": shuffle, "chunksizes": tuple(chunks)}
+    return encoding
+
+def rechunk_file(src, dst, tile_lat, tile_lon, complevel, shuffle):
+    # Write to a partial file and rename on completion so a crash never leaves a truncated output behind
+    part_path = f"{dst}.part"
+    try:
+        with xr.open_dataset(src, decode_times=False, mask_and_scale=False) as ds:
+            ds.load()
+            encoding = chunk_encoding(ds, tile_lat, tile_lon, complevel, shuffle)
+            for name in encoding:
+                # Keep the original fill value and dtype, drop the source chunking/compression
+                for key in ("_FillValue", "dtype"):
+                    if key in ds[name].encoding:
+                        encoding[name][key] = ds[name].encoding[key]
+            ds.to_netcdf(part_path, encoding=encoding, format="NETCDF4")
+        os.replace(part_path, dst)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+def main_variable(nc):
+    # The data variable the benchmark reads, the first one on a (time, lat, lon) grid
+    for name, var in nc.variables.items():
+        if var.dimensions[:1] == ("time",) and var.dimensions[-2:] == ("lat", "lon"):
+            return var
+    return None
+
+def drop_page_cache(path):
+    # Ask the kernel to forget the cached pages of the file (flushed first, a file just written is still dirty)
+    # so the benchmark reads from disk. A no-op where posix_fadvise is not available.
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def timed_read(path, index):
+    # One read on a fresh handle, so no HDF5 chunk cache carries over between reads
+    start = time.perf_counter()
+    with netCDF4.Dataset(path) as nc:
+        var = main_variable(nc)
+        var.set_auto_maskandscale(False)
+        var[index]
+    return time.perf_counter() - start
+
+def time_reads(path):
+    # Milliseconds per point (full time series of one pixel) and per window read, starting from a cold page cache
+    rng = np.random.default_rng(seed)
+    with netCDF4.Dataset(path) as nc:
+        var = main_variable(nc)
+        if var is None:
+            return None, None, None
+        shape = var.shape
+        chunking = var.chunking()
+    n_lat, n_lon = shape[-2:]
+    extra = (0,) * (len(shape) - 3)
+
+    drop_page_cache(path)
+    points = zip(rng.integers(0, n_lat, n_points), rng.integers(0, n_lon, n_points))
+    point_ms = sum(timed_read(path, (slice(None), *extra, lat, lon)) for lat, lon in points) * 1000 / n_points
+
+    drop_page_cache(path)
+    size = min(window_size, n_lat, n_lon)
+    windows = zip(rng.integers(0, n_lat - size + 1, n_windows), rng.integers(0, n_lon - size + 1, n_windows))
+    window_ms = sum(timed_read(path, (slice(None), *extra, slice(lat, lat + size), slice(lon, lon + size)))
+                    for lat, lon in windows) * 1000 / n_windows
+
+    return point_ms, window_ms, "contiguous" if chunking == "contiguous" else "x".join(map(str, chunking))
+
+def run_task(task, args):
+    # Runs in a worker process. The source is timed before the rewrite so its reads are not already cached
+    src, dst = task["src"], task["dst"]
+    row = {"file": task["relative_path"]}
+    try:
+        row["point_ms_before"], row["window_ms_before"], row["chunks_before"] = time_reads(src)
+        row["bytes_before"] = os.path.getsize(src)
+
+        rechunk_file(src, dst, args.tile_lat, args.tile_lon, args.complevel, not args.no_shuffle)
+
+        row["point_ms_after"], row["window_ms_after"], row["chunks_after"] = time_reads(dst)
+        row["bytes_after"] = os.path.getsize(dst)
+        return task, row, None
+    except (OSError, ValueError, RuntimeError) as e:
+        return task, row, str(e)
+
+def plan_tasks(args, manifest):
+    tasks = []
+    for root, _, files in os.walk(input_path):
+        for file in sorted(files):
+            if not file.endswith(".nc"):
+                continue
+            src = os.path.join(root, file)
+            relative_path = os.path.relpath(src, input_path)
+            if args.model and relative_path.split(os.sep)[0] not in args.model:
+                continue
+
+            dst = src if args.in_place else os.path.join(output_path, relative_path)
+            record = build_record(src, tile_lat=args.tile_lat, tile_lon=args.tile_lon, complevel=args.complevel,
+                                  shuffle=not args.no_shuffle, tool_version=tool_version)
+
+            # In place the source changes with every rewrite, so only the output stamp can say it is done
+            if args.in_place:
+                entry = manifest.get(relative_path, {})
+                if entry.get("output_stamp") == record["source_stamp"] and \
+                        all(entry.get(k) == record[k] for k in ("tile_lat", "tile_lon", "complevel", "shuffle", "tool_version")):
+                    continue
+            elif not needs_rebuild(manifest, relative_path, dst, record):
+                continue
+
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            tasks.append({"src": src, "dst": dst, "relative_path": relative_path, "record": record})
+    return tasks
+
+def write_report(rows):
+    report = pd.DataFrame(rows)
+    if report.empty:
+        return report
+    report["point_speedup"] = report["point_ms_before"] / report["point_ms_after"]
+    report["window_speedup"] = report["window_ms_before"] / report["window_ms_after"]
+    report["size_ratio"] = report["bytes_after"] / report["bytes_before"]
+
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    report.to_csv(report_path, index=False)
+
+    print(f"Median point read speedup:  {report['point_speedup'].median():.1f}x")
+    print(f"Median window read speedup: {report['window_speedup'].median():.1f}x")
+    print(f"Total size: {report['bytes_before'].sum() / 1024**3:.2f} GiB -> {report['bytes_after'].sum() / 1024**3:.2f} GiB")
+    print(f"Report saved to {report_path}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Rewrite the standardised TRENDY files with time-contiguous spatial chunks')
+    models_group = parser.add_mutually_exclusive_group(required=True)
+    models_group.add_argument('--model', nargs='+', help='Model name(s) to rewrite')
+    models_group.add_argument('--all', action='store_true', help='Rewrite every model under the standardised output directory')
+    parser.add_argument('--tile-lat', type=int, default=30, help='Chunk size along lat')
+    parser.add_argument('--tile-lon', type=int, default=60, help='Chunk size along lon')
+    parser.add_argument('--complevel', type=int, default=4, choices=range(0, 10), help='zlib level, 0 disables compression')
+    parser.add_argument('--no-shuffle', action='store_true', help='Disable the shuffle filter')
+    parser.add_argument('--in-place', action='store_true', help='Replace the standardised files instead of writing a separate tree')
+    parser.add_argument('--jobs', type=int, default=1, help='Maximum number of files rewritten at once')
+    args = parser.parse_args()
+
+    # Records how each output was built, kept next to the output directory
+    manifest_path = f"{input_path if args.in_place else output_path}_rechunk_manifest.json"
+    manifest = load_manifest(manifest_path)
+    tasks = plan_tasks(args, manifest)
+    print(f"{len(tasks)} files to rewrite")
+
+    rows, failures = [], []
+
+    def report(task, row, error):
+        if error is not None:
+            tqdm.write(f"Failed rechunking {task['src']}: {error}")
+            failures.append(task)
+        else:
+            rows.append(row)
+            entry = record_output(manifest, task["relative_path"], task["dst"], task["record"])
+            update_manifest({task["relative_path"]: entry}, manifest_path)
+            if args.in_place:
+                # Same data, new file stamp: keep the conversion from treating the output as stale
+                refresh_output_stamp(task["relative_path"], task["dst"], task["record"]["source_stamp"], conversion_manifest)
+        pbar.update(1)
+
+    with tqdm(total=len(tasks), desc="Rechunking", unit="file") as pbar:
+        if args.jobs <= 1:
+            for task in tasks:
+                report(*run_task(task, args))
+        else:
+            with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+                futures = [pool.submit(run_task, task, args) for task in tasks]
+                for future in as_completed(futures):
+                    report(*future.result())
+
+    write_report(rows)
+
+    if failures:
+        print(f"{len(failures)} of {len(tasks)} rewrites failed")
+
+if __name__ == "__main__":
+    main()